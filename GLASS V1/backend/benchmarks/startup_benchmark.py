@@ -0,0 +1,110 @@
+"""Startup-time benchmark for the API process.
+
+Run from the backend directory:
+
+    python benchmarks/startup_benchmark.py --budget 1.5
+    python benchmarks/startup_benchmark.py --ready --port 8765
+
+Measures how long `import main` takes in a fresh interpreter and fails if the
+median exceeds the budget or a heavy dependency gets imported eagerly. With
+--ready it also starts uvicorn and times how long /health/ready takes to
+return 200 (i.e. until the background preload finishes).
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Must not be imported just by booting a worker
+HEAVY_MODULES = ["polars", "pandas", "pyarrow", "google.generativeai"]
+
+IMPORT_PROBE = f"""
+import json, sys, time
+t = time.perf_counter()
+import main
+elapsed = time.perf_counter() - t
+heavy = [m for m in {HEAVY_MODULES!r} if m in sys.modules]
+print(json.dumps({{"seconds": elapsed, "heavy": heavy}}))
+"""
+
+
+def time_import(runs: int):
+    samples, heavy = [], set()
+    for _ in range(runs):
+        out = subprocess.run(
+            [sys.executable, "-c", IMPORT_PROBE],
+            cwd=BACKEND_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip().splitlines()[-1]
+        result = json.loads(out)
+        samples.append(result["seconds"])
+        heavy.update(result["heavy"])
+    return samples, sorted(heavy)
+
+
+def time_ready(port: int, timeout: float):
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port)],
+        cwd=BACKEND_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    live = ready = None
+    try:
+        while time.perf_counter() - start < timeout:
+            try:
+                if live is None:
+                    urllib.request.urlopen(f"http://127.0.0.1:{port}/health/live")
+                    live = time.perf_counter() - start
+                urllib.request.urlopen(f"http://127.0.0.1:{port}/health/ready")
+                ready = time.perf_counter() - start
+                break
+            except (urllib.error.URLError, ConnectionError):
+                time.sleep(0.05)
+    finally:
+        server.terminate()
+        server.wait()
+    return live, ready
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget", type=float, default=float(os.getenv("GLASS_STARTUP_BUDGET", 1.5)),
+                        help="maximum median import time in seconds")
+    parser.add_argument("--ready", action="store_true", help="also time uvicorn until /health/ready")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--ready-timeout", type=float, default=120.0)
+    args = parser.parse_args()
+
+    samples, heavy = time_import(args.runs)
+    report = {
+        "import_median_s": round(statistics.median(samples), 3),
+        "import_max_s": round(max(samples), 3),
+        "eager_heavy_modules": heavy,
+    }
+    if args.ready:
+        live, ready = time_ready(args.port, args.ready_timeout)
+        report["live_s"] = live and round(live, 3)
+        report["ready_s"] = ready and round(ready, 3)
+    print(json.dumps(report, indent=2))
+
+    failures = []
+    if statistics.median(samples) > args.budget:
+        failures.append(f"median import time {statistics.median(samples):.3f}s exceeds budget {args.budget}s")
+    if heavy:
+        failures.append(f"heavy modules imported at startup: {', '.join(heavy)}")
+    if args.ready and report["ready_s"] is None:
+        failures.append(f"service not ready within {args.ready_timeout}s")
+    for failure in failures:
+        print(f"[FAIL] {failure}", file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
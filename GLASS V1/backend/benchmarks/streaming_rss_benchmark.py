@@ -0,0 +1,103 @@
+"""Peak-RSS benchmark for the eager and streaming query modes.
+
+Run from the backend directory:
+
+    python benchmarks/streaming_rss_benchmark.py --rows 500000 1000000 2000000 4000000
+
+For each size a synthetic ledger is written to a scratch UPLOAD_DIR, then the
+Drilldown I cube and a Drilldown IV query are computed in a fresh process per
+mode and the process's peak RSS is recorded. The line-item index and fact
+files are also built from a lazy scan in a fresh process, as a streaming
+ingest does. With --check the run fails if a streaming peak at the largest
+size grows more than --tolerance times the peak at the smallest size.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+GENERATE = """
+import sys
+import polars as pl
+n = int(sys.argv[1])
+i = pl.int_range(n, eager=True)
+dates = pl.date_range(pl.date(2018, 1, 1), pl.date(2024, 10, 4), eager=True).dt.strftime("%Y-%m-%d")
+pl.DataFrame({
+    "Document Number": i,
+    "G/L Account": "GL" + (i % 20).cast(pl.String),
+    "Business Area": "BA" + (i % 50).cast(pl.String),
+    "Document Type": pl.Series(["KR", "DR", "SA", "ZP"]).gather(i % 4),
+    "Amount in Local Currency": ((i * 7919) % 100000).cast(pl.Float64) / 100,
+    "Vendor Code": "V" + (i % 997).cast(pl.String),
+    "Vendor Name": "Vendor " + (i % 997).cast(pl.String),
+    "Customer Code": "C" + (i % 991).cast(pl.String),
+    "Customer Name": "Customer " + (i % 991).cast(pl.String),
+    "Posting Date": dates.gather(i % dates.len()),
+    "Text": "line item " + i.cast(pl.String),
+}).write_parquet("uploaded_files/input_data.parquet")
+"""
+
+QUERY = """
+import json, resource
+from services import queries
+queries.cube("GL3", "2024-06-30")
+queries.drilldown4("GL3", ">5 years", "Others", "BA3", "2024-06-30")
+print(json.dumps({"peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}))
+"""
+
+BUILD = """
+import json, resource
+from services import dimensions, line_items
+line_items.build_index()
+dimensions.build()
+print(json.dumps({"peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}))
+"""
+
+
+def run_script(script: str, workdir: str, mode: str) -> float:
+    env = dict(os.environ, GLASS_QUERY_MODE=mode, PYTHONPATH=BACKEND_DIR,
+               GLASS_CACHE_MAX_BYTES="0")  # keep the disk cache from answering
+    out = subprocess.run([sys.executable, "-c", script], cwd=workdir, env=env,
+                         capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])["peak_rss_mb"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[250_000, 500_000, 1_000_000, 2_000_000])
+    parser.add_argument("--modes", nargs="+", default=["eager", "streaming"])
+    parser.add_argument("--check", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=1.5)
+    args = parser.parse_args()
+
+    results = []
+    for rows in args.rows:
+        with tempfile.TemporaryDirectory() as workdir:
+            os.makedirs(os.path.join(workdir, "uploaded_files"))
+            subprocess.run([sys.executable, "-c", GENERATE, str(rows)], cwd=workdir, check=True)
+            size_mb = os.path.getsize(os.path.join(workdir, "uploaded_files", "input_data.parquet")) / 2**20
+            row = {"rows": rows, "parquet_mb": round(size_mb, 1)}
+            for mode in args.modes:
+                row[f"{mode}_peak_rss_mb"] = round(run_script(QUERY, workdir, mode), 1)
+            if "streaming" in args.modes:
+                row["streaming_build_peak_rss_mb"] = round(run_script(BUILD, workdir, "streaming"), 1)
+            results.append(row)
+            print(json.dumps(row))
+
+    if args.check and "streaming" in args.modes:
+        failed = False
+        for field in ["streaming_peak_rss_mb", "streaming_build_peak_rss_mb"]:
+            first, last = results[0][field], results[-1][field]
+            if last > first * args.tolerance:
+                print(f"[FAIL] {field} grew from {first} MB to {last} MB", file=sys.stderr)
+                failed = True
+        if failed:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
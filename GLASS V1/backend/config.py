@@ -0,0 +1,99 @@
+import os
+
+UPLOAD_DIR = "./uploaded_files"
+PARQUET_FILE = os.path.join(UPLOAD_DIR, "input_data.parquet")
+MAPPING_FILE = os.path.join(UPLOAD_DIR, "mapping_file.xlsx")  # or .csv
+
+# ========== Organisational hierarchy ==========
+# The mapping file assigns each Cost Center (RCNTR), Profit Center (PRCTR) or
+# Business Area to a Division, and optionally a Segment and Region above it.
+# Rows are matched on the most specific key the mapping and the ledger share.
+HIERARCHY_LEAF_KEYS = ["Cost Center", "Profit Center", "Business Area"]
+HIERARCHY_LEVELS = ["Division", "Segment", "Region"]  # bottom-up
+
+# ========== Storage ==========
+# Parquet is always kept as the compact archival copy. "ipc" additionally writes an
+# uncompressed Arrow IPC file that is memory-mapped on load (zero-copy, page cache
+# shared across processes); "ipc_lz4" trades some decode time for a smaller file.
+IPC_FILE = os.path.join(UPLOAD_DIR, "input_data.arrow")
+STORAGE_FORMATS = ("parquet", "ipc", "ipc_lz4")
+STORAGE_FORMAT = os.getenv("GLASS_STORAGE_FORMAT", "parquet")
+
+# Line items sorted on (G/L Account, Business Area, Posting Date, Document Number),
+# built at ingest for the paginated line-item browser
+LINE_ITEM_INDEX_FILE = os.path.join(UPLOAD_DIR, "line_items.arrow")
+
+# ========== Counterparty dimensions ==========
+# Built at ingest: integer-keyed vendor, customer and document type tables with
+# blanks folded into "Others" and one name per code, plus a narrow fact file that
+# carries only the keys next to the columns the aggregate queries need
+COUNTERPARTY_FACTS_FILE = os.path.join(UPLOAD_DIR, "counterparty_facts.arrow")
+# Streaming mode scans this Parquet copy instead; scanning the memory-mapped file
+# would fault the whole fact table into the process
+COUNTERPARTY_FACTS_PARQUET_FILE = os.path.join(UPLOAD_DIR, "counterparty_facts.parquet")
+DIMENSION_FILES = {
+    "vendors": os.path.join(UPLOAD_DIR, "dim_vendors.arrow"),
+    "customers": os.path.join(UPLOAD_DIR, "dim_customers.arrow"),
+    "document_types": os.path.join(UPLOAD_DIR, "dim_document_types.arrow"),
+}
+
+# ========== Query mode ==========
+# "eager" keeps the ledger resident in memory; "streaming" runs every pipeline as a
+# lazy scan on Polars' streaming engine with bounded memory; "auto" switches to
+# streaming once the Parquet file is larger than STREAMING_THRESHOLD_BYTES.
+QUERY_MODE = os.getenv("GLASS_QUERY_MODE", "auto")
+STREAMING_THRESHOLD_BYTES = int(os.getenv("GLASS_STREAMING_THRESHOLD_BYTES", 2 * 1024 * 1024 * 1024))
+
+# ========== Shared dataset ==========
+# With several uvicorn workers, one process publishes the ledger as an immutable
+# Arrow file plus a version manifest and every worker memory-maps it read-only,
+# so RAM does not grow with the worker count. Point GLASS_SHARED_DIR at /dev/shm
+# for a tmpfs-backed copy (mind the container's shm size).
+SHARED_DATASET = os.getenv("GLASS_SHARED_DATASET", "0") == "1"
+SHARED_DIR = os.getenv("GLASS_SHARED_DIR", os.path.join(UPLOAD_DIR, "shared"))
+
+# ========== Snapshots ==========
+# The files above live in immutable, versioned snapshot directories under
+# SNAPSHOTS_DIR; a manifest names the current one and is swapped atomically.
+# The paths above only give each file's name within a snapshot.
+SNAPSHOTS_DIR = os.path.join(UPLOAD_DIR, "snapshots")
+
+# ========== Upload jobs ==========
+# Uploads are assembled in a staging snapshot and published only after every stage succeeds
+JOBS_DIR = os.path.join(UPLOAD_DIR, "jobs")
+REQUIRED_COLUMNS = ["G/L Account", "Business Area", "Posting Date", "Amount in Local Currency"]
+
+# ========== Export ==========
+# Rows per chunk when streaming drilldown line items to the client
+EXPORT_CHUNK_ROWS = int(os.getenv("GLASS_EXPORT_CHUNK_ROWS", 50_000))
+
+# ========== AI summary ==========
+# Generated last in progressive responses; left out when no key is configured
+GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
+AI_SUMMARY_MODEL = os.getenv("GLASS_AI_SUMMARY_MODEL", "gemini-pro")
+
+# ========== Prefetch ==========
+# After Drilldown I, compute Drilldown II/III for the largest cells into the result
+# cache on a single thread that only runs while the worker has no requests in
+# flight. Off unless GLASS_PREFETCH=1; at most PREFETCH_TOP_K cells per request
+# and PREFETCH_MAX_PENDING queued tasks.
+PREFETCH_ENABLED = os.getenv("GLASS_PREFETCH", "0") == "1"
+PREFETCH_TOP_K = int(os.getenv("GLASS_PREFETCH_TOP_K", 3))
+PREFETCH_MAX_PENDING = int(os.getenv("GLASS_PREFETCH_MAX_PENDING", 32))
+
+# ========== Variance ==========
+# Every published dataset version gets a date-independent movement pre-aggregate
+# (per G/L, Posting Date, hierarchy, Business Area and vendor), so it can be
+# compared at any reference date after newer uploads replace it. The newest
+# MOVEMENTS_KEEP_VERSIONS are kept.
+MOVEMENTS_DIR = os.path.join(UPLOAD_DIR, "movements")
+MOVEMENTS_KEEP_VERSIONS = int(os.getenv("GLASS_MOVEMENTS_KEEP_VERSIONS", 24))
+
+# ========== Result cache ==========
+# Derived datasets, cubes and query results survive restarts under UPLOAD_DIR.
+CACHE_DIR = os.path.join(UPLOAD_DIR, "cache")
+CACHE_MAX_BYTES = int(os.getenv("GLASS_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+CACHE_MAX_ENTRIES = int(os.getenv("GLASS_CACHE_MAX_ENTRIES", 5000))
+CACHE_MEMORY_ENTRIES = int(os.getenv("GLASS_CACHE_MEMORY_ENTRIES", 256))
+
+os.makedirs(UPLOAD_DIR, exist_ok=True)
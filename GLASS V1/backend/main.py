@@ -1,12 +1,29 @@
 from fastapi import FastAPI, UploadFile, File, Query
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-import polars as pl
+from contextlib import asynccontextmanager
+import importlib.util
 import os
 import shutil
-from datetime import datetime
 
-app = FastAPI()
+from config import PARQUET_FILE, MAPPING_FILE, STORAGE_FORMAT, STORAGE_FORMATS, SHARED_DATASET
+from services import dimensions, export, hierarchy, jobs, line_items, movements, prefetch, preload, progressive, queries, shared_dataset, snapshots
+from services.file_handler import dataset_key, scan_dataset, storage_format, use_streaming
+from services.snapshots import resolve
+from services.lazy import lazy_import
+
+# Heavy dependencies load on first use so workers become live quickly
+pl = lazy_import("polars")
+
+
+# ========== Startup ==========
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    preload.start()
+    yield
+
+
+app = FastAPI(lifespan=lifespan)
 
 # CORS for local dev
 app.add_middleware(
@@ -17,81 +34,79 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-UPLOAD_DIR = "./uploaded_files"
-PARQUET_FILE = os.path.join(UPLOAD_DIR, "input_data.parquet")
-MAPPING_FILE = os.path.join(UPLOAD_DIR, "mapping_file.xlsx")  # or .csv
+# Each request reads one dataset snapshot from start to end, whatever is uploaded meanwhile
+app.add_middleware(snapshots.PinSnapshotMiddleware)
 
-os.makedirs(UPLOAD_DIR, exist_ok=True)
+# Speculative prefetching waits while requests are in flight
+app.add_middleware(prefetch.ForegroundMiddleware)
 
 
-# ========== Helper: Add derived columns ==========
-def derive_columns(df: pl.DataFrame, current_date: str) -> pl.DataFrame:
-    df = df.with_columns([
-        pl.col("Posting Date").str.strptime(pl.Date, fmt="%Y-%m-%d", strict=False),
-    ])
-
-    current_date_parsed = datetime.strptime(current_date, "%Y-%m-%d")
-    df = df.with_columns([
-        (pl.lit(current_date_parsed) - pl.col("Posting Date")).dt.days().alias("AgeDays")
-    ])
-
-    df = df.with_columns([
-        pl.when(pl.col("AgeDays") < 183).then("<6 months")
-        .when(pl.col("AgeDays") < 365).then("6 months - 1 year")
-        .when(pl.col("AgeDays") < 730).then("1 - 2 years")
-        .when(pl.col("AgeDays") < 1095).then("2 - 3 years")
-        .when(pl.col("AgeDays") < 1825).then("3 - 5 years")
-        .otherwise(">5 years").alias("Ageing")
-    ])
-
-    # Map Division from mapping file
-    if os.path.exists(MAPPING_FILE):
-        try:
-            if MAPPING_FILE.endswith(".csv"):
-                mapping_df = pl.read_csv(MAPPING_FILE)
-            else:
-                mapping_df = pl.read_excel(MAPPING_FILE)
-
-            df = df.join(mapping_df, on="Business Area", how="left")
-            df = df.with_columns([
-                pl.col("Division").fill_null("Others")
-            ])
-        except Exception as e:
-            print(f"[WARN] Failed to load mapping: {e}")
-            df = df.with_columns([pl.lit("Others").alias("Division")])
-    else:
-        df = df.with_columns([pl.lit("Others").alias("Division")])
+# ========== Health ==========
+@app.get("/health/live")
+def liveness():
+    return {"status": "alive"}
 
-    return df
+@app.get("/health/ready")
+def readiness():
+    status = preload.status()
+    if not preload.is_ready():
+        return JSONResponse(status_code=503, content={"status": "starting", "preload": status})
+    return {"status": "ready", "preload": status}
 
 
 # ========== File Upload ==========
 @app.post("/upload")
-async def upload_file(file: UploadFile = File(...)):
+def upload_file(file: UploadFile = File(...), storage: str = Query(None)):
+    job_id = None
     try:
-        temp_path = os.path.join(UPLOAD_DIR, file.filename)
-        with open(temp_path, "wb") as f:
-            shutil.copyfileobj(file.file, f)
-
-        df = pl.read_csv(temp_path, separator=";")
-        df.write_parquet(PARQUET_FILE)
-
-        return {"status": "success", "message": "CSV uploaded and converted to Parquet."}
+        storage = storage or STORAGE_FORMAT
+        if storage not in STORAGE_FORMATS:
+            return JSONResponse(status_code=400, content={"error": f"storage must be one of {', '.join(STORAGE_FORMATS)}"})
+
+        job_id = jobs.create(os.path.basename(file.filename), file.size, storage)["job_id"]
+        csv_path = jobs.save(job_id, file.file)
+        jobs.submit(job_id, csv_path, storage)
+
+        return JSONResponse(status_code=202, content={
+            "status": "accepted",
+            "message": "Upload received; conversion is running in the background.",
+            "job_id": job_id,
+            "status_url": f"/upload/jobs/{job_id}",
+        })
     except Exception as e:
-        return JSONResponse(status_code=500, content={"status": "error", "message": str(e)})
+        if job_id is not None:
+            jobs.fail(job_id, str(e))
+        return JSONResponse(status_code=500, content={"status": "error", "message": str(e), "job_id": job_id})
+
+@app.get("/upload/jobs/{job_id}")
+def upload_job_status(job_id: str):
+    job = jobs.status(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": "Unknown job."})
+    return job
 
 @app.post("/upload-mapping")
-async def upload_mapping(file: UploadFile = File(...)):
+def upload_mapping(file: UploadFile = File(...)):
     try:
         ext = os.path.splitext(file.filename)[-1].lower()
         if ext not in [".xlsx", ".csv"]:
             return JSONResponse(status_code=400, content={"error": "Only .xlsx or .csv allowed"})
 
-        path = MAPPING_FILE
-        with open(path, "wb") as f:
+        # Compile the hierarchy before it replaces the current mapping
+        staging_dir = snapshots.new_staging_dir()
+        tmp_path = os.path.join(staging_dir, os.path.basename(MAPPING_FILE))
+        with open(tmp_path, "wb") as f:
             shutil.copyfileobj(file.file, f)
+        try:
+            compiled = hierarchy.compile_mapping(hierarchy.read_mapping(tmp_path))
+        except Exception as e:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            return JSONResponse(status_code=400, content={"status": "error", "message": f"Invalid mapping: {e}"})
+        # A new snapshot with this mapping and the current data files
+        snapshots.publish(staging_dir, carry=snapshots.DATA_FILES)
+        movements.build_in_background()
 
-        return {"status": "success", "message": "Mapping file uploaded."}
+        return {"status": "success", "message": "Mapping file uploaded.", "levels": compiled["levels"], "leaf_keys": compiled["leaf_keys"]}
     except Exception as e:
         return JSONResponse(status_code=500, content={"status": "error", "message": str(e)})
 
@@ -100,8 +115,12 @@ async def upload_mapping(file: UploadFile = File(...)):
 @app.get("/gl-accounts")
 def get_gl_accounts():
     try:
-        df = pl.read_parquet(PARQUET_FILE)
-        gls = df.select("G/L Account").unique().to_series().to_list()
+        # From the narrow fact file; the wide ledger is never loaded for this
+        if use_streaming():
+            df = dimensions.scan_facts().select("G/L Account").unique().collect(engine="streaming")
+        else:
+            df = dimensions.load()[0].select("G/L Account").unique()
+        gls = df.to_series().to_list()
         return {"gl_accounts": gls}
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": str(e)})
@@ -109,56 +128,74 @@ def get_gl_accounts():
 @app.get("/load-default")
 def load_default_file():
     try:
-        if not os.path.exists(PARQUET_FILE):
+        if not os.path.exists(resolve(PARQUET_FILE)):
             return JSONResponse(status_code=404, content={"error": "No file uploaded."})
 
-        df = pl.read_parquet(PARQUET_FILE)
-        return {"columns": df.columns, "rows": df.head(5).to_dicts()}
+        df = scan_dataset().head(5).collect()
+        return {"columns": df.columns, "rows": df.to_dicts(), "storage": storage_format()}
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": str(e)})
 
+@app.get("/dataset-version")
+def dataset_version():
+    if use_streaming():
+        mode = "streaming"
+    elif SHARED_DATASET:
+        mode = "shared"
+    else:
+        mode = "resident"
+    return {
+        "pid": os.getpid(),
+        "mode": mode,
+        "dataset": dataset_key(),
+        "attached_version": shared_dataset.attached_version(),
+        "manifest": shared_dataset.read_manifest() if SHARED_DATASET else None,
+    }
+
+@app.get("/cache-stats")
+def cache_stats():
+    return queries.result_cache.stats()
+
+@app.get("/coalescing-stats")
+def coalescing_stats():
+    return queries.flights.stats()
+
+@app.get("/prefetch-stats")
+def prefetch_stats():
+    return prefetch.stats()
+
+@app.get("/snapshots")
+def snapshot_stats():
+    return snapshots.stats()
+
 
 # ========== Filtered Summary ==========
 @app.get("/filtered-summary")
 def filtered_summary(gl_account: str = Query(...), current_date: str = Query(None)):
     try:
-        df = pl.read_parquet(PARQUET_FILE)
-        df = df.filter(pl.col("G/L Account") == gl_account)
-        if current_date is None:
-            current_date = datetime.now().strftime("%Y-%m-%d")
-        df = derive_columns(df, current_date)
-
-        ageing_group = df.groupby("Ageing").agg(
-            pl.col("Amount in Local Currency").sum().alias("Total Amount")
-        ).sort("Ageing")
-
-        division_group = df.groupby("Division").agg(
-            pl.col("Amount in Local Currency").sum().alias("Total Amount")
-        ).sort("Division")
-
-        return {
-            "ageing_table": ageing_group.to_dicts(),
-            "division_table": division_group.to_dicts()
-        }
+        return queries.filtered_summary(gl_account, queries.resolve_date(current_date))
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": str(e)})
 
+@app.get("/filtered-summary/stream")
+def filtered_summary_stream(gl_account: str = Query(...), current_date: str = Query(None), ai_summary: bool = Query(True)):
+    if dataset_key() is None:
+        return JSONResponse(status_code=404, content={"error": "No file uploaded."})
+
+    current_date = queries.resolve_date(current_date)
+    tables = queries.filtered_summary_tables(gl_account, current_date)
+    summarize = (lambda sent: queries.filtered_summary_ai(gl_account, current_date, sent)) if ai_summary else None
+    return StreamingResponse(progressive.stream_tables(tables, summarize), media_type="text/event-stream", headers=progressive.SSE_HEADERS)
+
 
 # ========== Drilldown I ==========
 @app.get("/drilldown1")
 def drilldown_level_1(gl_account: str = Query(...), current_date: str = Query(None)):
     try:
-        df = pl.read_parquet(PARQUET_FILE)
-        df = df.filter(pl.col("G/L Account") == gl_account)
-        if current_date is None:
-            current_date = datetime.now().strftime("%Y-%m-%d")
-        df = derive_columns(df, current_date)
-
-        grouped = df.groupby(["Ageing", "Division"]).agg(
-            pl.col("Amount in Local Currency").sum().alias("Total Amount")
-        ).sort(["Ageing", "Division"])
-
-        return {"columns": grouped.columns, "rows": grouped.to_dicts()}
+        current_date = queries.resolve_date(current_date)
+        result = queries.drilldown1(gl_account, current_date)
+        prefetch.after_drilldown1(gl_account, current_date, result)
+        return result
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": str(e)})
 
@@ -167,19 +204,7 @@ def drilldown_level_1(gl_account: str = Query(...), current_date: str = Query(No
 @app.get("/drilldown2")
 def drilldown_level_2(gl_account: str = Query(...), ageing: str = Query(...), division: str = Query(...), current_date: str = Query(None)):
     try:
-        df = pl.read_parquet(PARQUET_FILE)
-        if current_date is None:
-            current_date = datetime.now().strftime("%Y-%m-%d")
-        df = df.filter(pl.col("G/L Account") == gl_account)
-        df = derive_columns(df, current_date)
-
-        df = df.filter((pl.col("Ageing") == ageing) & (pl.col("Division") == division))
-
-        grouped = df.groupby("Business Area").agg(
-            pl.col("Amount in Local Currency").sum().alias("Total Amount")
-        ).sort("Total Amount", descending=True)
-
-        return {"columns": grouped.columns, "rows": grouped.to_dicts()}
+        return queries.drilldown2(gl_account, ageing, division, queries.resolve_date(current_date))
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": str(e)})
 
@@ -188,19 +213,7 @@ def drilldown_level_2(gl_account: str = Query(...), ageing: str = Query(...), di
 @app.get("/drilldown3")
 def drilldown_level_3(gl_account: str = Query(...), ageing: str = Query(...), current_date: str = Query(None)):
     try:
-        df = pl.read_parquet(PARQUET_FILE)
-        if current_date is None:
-            current_date = datetime.now().strftime("%Y-%m-%d")
-        df = df.filter(pl.col("G/L Account") == gl_account)
-        df = derive_columns(df, current_date)
-
-        df = df.filter(pl.col("Ageing") == ageing)
-
-        grouped = df.groupby(["Division", "Business Area"]).agg(
-            pl.col("Amount in Local Currency").sum().alias("Total Amount")
-        ).sort(["Division", "Business Area"])
-
-        return {"columns": grouped.columns, "rows": grouped.to_dicts()}
+        return queries.drilldown3(gl_account, ageing, queries.resolve_date(current_date))
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": str(e)})
 
@@ -209,49 +222,127 @@ def drilldown_level_3(gl_account: str = Query(...), ageing: str = Query(...), cu
 @app.get("/drilldown4")
 def drilldown_level_4(gl_account: str = Query(...), ageing: str = Query(...), division: str = Query(...), business_area: str = Query(...), current_date: str = Query(None)):
     try:
-        df = pl.read_parquet(PARQUET_FILE)
-        if current_date is None:
-            current_date = datetime.now().strftime("%Y-%m-%d")
-        df = df.filter(pl.col("G/L Account") == gl_account)
-        df = derive_columns(df, current_date)
-
-        df = df.filter(
-            (pl.col("Ageing") == ageing) &
-            (pl.col("Division") == division) &
-            (pl.col("Business Area") == business_area)
-        )
+        return queries.drilldown4(gl_account, ageing, division, business_area, queries.resolve_date(current_date))
+    except Exception as e:
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
+@app.get("/drilldown4/stream")
+def drilldown_level_4_stream(gl_account: str = Query(...), ageing: str = Query(...), division: str = Query(...), business_area: str = Query(...), current_date: str = Query(None), ai_summary: bool = Query(True)):
+    if dataset_key() is None:
+        return JSONResponse(status_code=404, content={"error": "No file uploaded."})
+
+    current_date = queries.resolve_date(current_date)
+    tables = queries.drilldown4_tables(gl_account, ageing, division, business_area, current_date)
+    summarize = (lambda sent: queries.drilldown4_ai(gl_account, ageing, division, business_area, current_date, sent)) if ai_summary else None
+    return StreamingResponse(progressive.stream_tables(tables, summarize), media_type="text/event-stream", headers=progressive.SSE_HEADERS)
+
 
-        def blank_to_others(col):
-            return pl.when(pl.col(col).is_null() | (pl.col(col).str.strip_chars() == "")).then("Others").otherwise(pl.col(col))
+# ========== Variance ==========
+@app.get("/variance")
+def variance(gl_account: str = Query(...), base_date: str = Query(None), compare_date: str = Query(None), base_version: str = Query(None), compare_version: str = Query(None), top: int = Query(10, ge=1, le=500)):
+    try:
+        if dataset_key() is None:
+            return JSONResponse(status_code=404, content={"error": "No file uploaded."})
 
-        df = df.with_columns([
-            blank_to_others("Vendor Code").alias("Vendor Code"),
-            blank_to_others("Vendor Name").alias("Vendor Name"),
-            blank_to_others("Customer Code").alias("Customer Code"),
-            blank_to_others("Customer Name").alias("Customer Name"),
-            blank_to_others("Document Type").alias("Document Type"),
-        ])
+        base, compare = queries.variance_points(base_date, compare_date, base_version, compare_version)
+        return queries.variance(gl_account, base, compare, top)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    except Exception as e:
+        return JSONResponse(status_code=500, content={"error": str(e)})
 
-        vendor_grouped = df.groupby(["Vendor Code", "Vendor Name"]).agg(
-            pl.col("Amount in Local Currency").sum().alias("Total Amount")
-        ).sort("Total Amount", descending=True)
+@app.get("/variance/versions")
+def variance_versions():
+    return {"current": dataset_key(), "versions": movements.versions()}
 
-        customer_grouped = df.groupby(["Customer Code", "Customer Name"]).agg(
-            pl.col("Amount in Local Currency").sum().alias("Total Amount")
-        ).sort("Total Amount", descending=True)
+@app.get("/variance/stream")
+def variance_stream(gl_account: str = Query(...), base_date: str = Query(None), compare_date: str = Query(None), base_version: str = Query(None), compare_version: str = Query(None), top: int = Query(10, ge=1, le=500), ai_summary: bool = Query(True)):
+    if dataset_key() is None:
+        return JSONResponse(status_code=404, content={"error": "No file uploaded."})
+    try:
+        base, compare = queries.variance_points(base_date, compare_date, base_version, compare_version)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
 
-        doc_type_grouped = df.groupby("Document Type").agg(
-            pl.col("Amount in Local Currency").sum().alias("Total Amount")
-        ).sort("Total Amount", descending=True)
+    tables = queries.variance_tables(gl_account, base, compare, top)
+    summarize = (lambda sent: queries.variance_ai(gl_account, base, compare, top, sent)) if ai_summary else None
+    return StreamingResponse(progressive.stream_tables(tables, summarize), media_type="text/event-stream", headers=progressive.SSE_HEADERS)
 
+
+# ========== Hierarchy ==========
+@app.get("/hierarchy")
+def get_hierarchy():
+    try:
+        compiled = hierarchy.load()
+        if compiled is None:
+            return {"levels": ["Division"], "leaf_keys": [], "entries": {}}
         return {
-            "vendors": vendor_grouped.to_dicts(),
-            "customers": customer_grouped.to_dicts(),
-            "document_types": doc_type_grouped.to_dicts()
+            "levels": list(reversed(compiled["levels"])),
+            "leaf_keys": compiled["leaf_keys"],
+            "entries": {leaf: lookup.to_dicts() for leaf, lookup in compiled["lookups"].items()},
         }
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": str(e)})
 
+@app.get("/hierarchy/rollup")
+def hierarchy_rollup(gl_account: str = Query(...), level: str = Query(...), parent_level: str = Query(None), parent: str = Query(None), current_date: str = Query(None)):
+    try:
+        rollups = queries.hierarchy_rollups(gl_account, queries.resolve_date(current_date))
+        path = rollups["levels"]
+        if level not in path:
+            return JSONResponse(status_code=400, content={"error": f"level must be one of {', '.join(path)}"})
+        if parent_level is not None and (parent_level not in path or path.index(parent_level) >= path.index(level)):
+            return JSONResponse(status_code=400, content={"error": f"parent_level must be a level above {level}"})
+
+        rows = rollups["tables"][level]
+        if parent_level is not None:
+            rows = [row for row in rows if row[parent_level] == parent]
+        return {"levels": path, "columns": path[:path.index(level) + 1] + ["Total Amount"], "rows": rows}
+    except Exception as e:
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
+
+# ========== Line Items ==========
+@app.get("/line-items")
+def get_line_items(gl_account: str = Query(...), business_area: str = Query(None), ageing: str = Query(None), division: str = Query(None), current_date: str = Query(None),
+                   document_type: str = Query(None), vendor_code: str = Query(None), customer_code: str = Query(None), search: str = Query(None),
+                   sort_by: str = Query(None), descending: bool = Query(False), cursor: str = Query(None), limit: int = Query(100, ge=1, le=1000)):
+    try:
+        if dataset_key() is None:
+            return JSONResponse(status_code=404, content={"error": "No file uploaded."})
+
+        return line_items.page(
+            gl_account, queries.resolve_date(current_date), business_area=business_area, ageing=ageing,
+            division=division, document_type=document_type, vendor_code=vendor_code,
+            customer_code=customer_code, search=search, sort_by=sort_by, descending=descending,
+            cursor=cursor, limit=limit,
+        )
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    except Exception as e:
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
+
+# ========== Export ==========
+@app.get("/export")
+def export_line_items(gl_account: str = Query(...), ageing: str = Query(...), division: str = Query(...), business_area: str = Query(...), current_date: str = Query(None), format: str = Query("csv")):
+    try:
+        if format not in export.EXPORT_FORMATS:
+            return JSONResponse(status_code=400, content={"error": f"format must be one of {', '.join(export.EXPORT_FORMATS)}"})
+        if format == "xlsx" and importlib.util.find_spec("xlsxwriter") is None:
+            return JSONResponse(status_code=500, content={"error": "xlsx export requires the xlsxwriter package"})
+        if dataset_key() is None:
+            return JSONResponse(status_code=404, content={"error": "No file uploaded."})
+
+        chunks = export.iter_line_items(gl_account, ageing, division, business_area, queries.resolve_date(current_date))
+        media_type, ext = export.EXPORT_FORMATS[format]
+        return StreamingResponse(
+            export.WRITERS[format](chunks),
+            media_type=media_type,
+            headers={"Content-Disposition": f'attachment; filename="line_items.{ext}"'},
+        )
+    except Exception as e:
+        return JSONResponse(status_code=500, content={"error": str(e)})
 
 
 # from fastapi import FastAPI, UploadFile, File, Query
@@ -0,0 +1,70 @@
+from __future__ import annotations
+
+
+def summary_prompt(gl_account: str, ageing_table: list, division_table: list) -> str:
+    return f"""
+    Analyze the following financial data for G/L Account {gl_account} and provide a concise summary with actionable insights.
+
+    **Data Table 1: Balances by Ageing Bracket**
+    This table shows the total amount distributed across different ageing periods.
+    {ageing_table}
+
+    **Data Table 2: Balances by Division**
+    This table shows the total amount distributed across different company divisions.
+    {division_table}
+
+    **Your Task:**
+    1.  **Overall Summary:** Briefly describe the financial situation for this G/L account.
+    2.  **Ageing Analysis:** Point out any significant amounts in older ageing brackets (e.g., >1 year), as these could represent risks.
+    3.  **Division Analysis:** Highlight the divisions that hold the largest amounts. Is the amount concentrated or widely distributed?
+    4.  **Key Actionable Points:** Provide 2-3 bullet points on what requires immediate attention based on your analysis.
+    """
+
+
+def drilldown_prompt(gl_account: str, ageing: str, division: str, business_area: str,
+                     vendors: list, customers: list, document_types: list) -> str:
+    return f"""
+    Analyze the open items of G/L Account {gl_account} in business area {business_area}
+    (division {division}, ageing bracket {ageing}) and provide a concise summary with actionable insights.
+
+    **Data Table 1: Balances by Vendor**
+    {vendors}
+
+    **Data Table 2: Balances by Customer**
+    {customers}
+
+    **Data Table 3: Balances by Document Type**
+    {document_types}
+
+    **Your Task:**
+    1.  **Overall Summary:** Briefly describe what makes up this balance.
+    2.  **Concentration:** Point out vendors or customers that hold a disproportionate share of the amount.
+    3.  **Key Actionable Points:** Provide 2-3 bullet points on what requires immediate attention based on your analysis.
+    """
+
+
+def variance_prompt(gl_account: str, base: dict, compare: dict, totals: list,
+                    ageing_division: list, business_areas: list, vendors: list) -> str:
+    return f"""
+    Explain what changed in G/L Account {gl_account} between the base point
+    (dataset {base["version"]}, reference date {base["date"]}) and the comparison point
+    (dataset {compare["version"]}, reference date {compare["date"]}).
+
+    **Totals**
+    {totals}
+
+    **Data Table 1: Change by Ageing Bracket and Division**
+    {ageing_division}
+
+    **Data Table 2: Largest Movers by Business Area**
+    {business_areas}
+
+    **Data Table 3: Largest Movers by Vendor**
+    {vendors}
+
+    **Your Task:**
+    1.  **Overall Movement:** Briefly describe how the balance moved and why, based on the tables.
+    2.  **Ageing Shift:** Point out amounts that moved into older ageing brackets, as these could represent risks.
+    3.  **Top Movers:** Highlight the business areas and vendors behind most of the change.
+    4.  **Key Actionable Points:** Provide 2-3 bullet points on what requires immediate attention based on your analysis.
+    """
@@ -0,0 +1,32 @@
+from __future__ import annotations
+
+import importlib.util
+
+from config import GOOGLE_API_KEY, AI_SUMMARY_MODEL
+from services.lazy import lazy_import
+
+genai = lazy_import("google.generativeai")
+
+_configured = False
+
+
+def is_available() -> bool:
+    if not GOOGLE_API_KEY:
+        return False
+    try:
+        return importlib.util.find_spec("google.generativeai") is not None
+    except ModuleNotFoundError:
+        return False
+
+
+def _model():
+    global _configured
+    if not _configured:
+        genai.configure(api_key=GOOGLE_API_KEY)
+        _configured = True
+    return genai.GenerativeModel(AI_SUMMARY_MODEL)
+
+
+def generate(prompt: str) -> str:
+    return _model().generate_content(prompt).text
+
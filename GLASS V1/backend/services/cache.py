@@ -0,0 +1,211 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from services.lazy import lazy_import
+
+pl = lazy_import("polars")
+
+# Bumped when the shape of cached frames or results changes, so old entries stop matching
+KEY_VERSION = 3
+
+# Access times are buffered in memory and written to the index in batches
+TOUCH_FLUSH_ENTRIES = 256
+TOUCH_FLUSH_SECONDS = 30.0
+
+# Other workers write to the same index; the running totals are re-read this often
+TOTALS_REFRESH_SECONDS = 60.0
+
+
+class ResultCache:
+    """Disk-backed cache for query results (JSON) and derived frames (Parquet).
+
+    Every entry is tagged with the dataset key it was computed from, so a new
+    upload simply stops matching old entries; they age out through eviction.
+    Recently used results are also kept in a small in-process LRU. A hit never
+    writes to the index: access times are batched, and the entry count and
+    size used for eviction are kept as running totals.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, max_entries: int, memory_entries: int):
+        self.directory = directory
+        self.frames_dir = os.path.join(directory, "frames")
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        os.makedirs(self.frames_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._db = sqlite3.connect(
+            os.path.join(directory, "index.sqlite"), timeout=30, check_same_thread=False
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " key TEXT PRIMARY KEY, dataset TEXT, kind TEXT, size INTEGER,"
+            " created REAL, accessed REAL, hits INTEGER DEFAULT 0, payload BLOB)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+        self._db.commit()
+
+        self._touched = {}  # key -> (last access, hits since the last flush)
+        self._flushed_at = time.monotonic()
+        self._refresh_totals()
+
+    @staticmethod
+    def make_key(kind: str, params: dict, dataset: str) -> str:
+        raw = json.dumps({"kind": kind, "params": params, "dataset": dataset, "version": KEY_VERSION}, sort_keys=True)
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    # ---------- JSON results ----------
+    def get_result(self, key: str):
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self._touch(key)
+                return self._memory[key]
+
+            row = self._db.execute(
+                "SELECT payload FROM entries WHERE key = ? AND kind = 'result'", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value = json.loads(row[0])
+            self._remember(key, value)
+            self._touch(key)
+            return value
+
+    def put_result(self, key: str, dataset: str, value) -> None:
+        payload = json.dumps(value, default=str).encode()
+        with self._lock:
+            self._insert(key, dataset, "result", len(payload), payload)
+            self._remember(key, value)
+            self._evict()
+
+    # ---------- Frames ----------
+    def _frame_path(self, key: str) -> str:
+        return os.path.join(self.frames_dir, f"{key}.parquet")
+
+    def get_frame(self, key: str):
+        path = self._frame_path(key)
+        with self._lock:
+            row = self._db.execute(
+                "SELECT 1 FROM entries WHERE key = ? AND kind = 'frame'", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if not os.path.exists(path):
+                self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self._db.commit()
+                return None
+            self._touch(key)
+        return pl.read_parquet(path)
+
+    def put_frame(self, key: str, dataset: str, df: pl.DataFrame) -> None:
+        path = self._frame_path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        df.write_parquet(tmp_path)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._insert(key, dataset, "frame", os.path.getsize(path), None)
+            self._evict()
+
+    # ---------- Startup ----------
+    def warm(self, dataset: str) -> int:
+        """Load the most recently used results for `dataset` into memory."""
+        if dataset is None:
+            return 0
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT key, payload FROM entries WHERE dataset = ? AND kind = 'result'"
+                " ORDER BY accessed DESC LIMIT ?",
+                (dataset, self.memory_entries),
+            ).fetchall()
+            for key, payload in reversed(rows):
+                self._remember(key, json.loads(payload))
+        return len(rows)
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._flush_touches()
+            count, size = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        return {"entries": count, "bytes": size, "in_memory": len(self._memory)}
+
+    # ---------- Internals (caller holds the lock) ----------
+    def _remember(self, key: str, value) -> None:
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _touch(self, key: str) -> None:
+        _, hits = self._touched.get(key, (None, 0))
+        self._touched[key] = (time.time(), hits + 1)
+        if len(self._touched) >= TOUCH_FLUSH_ENTRIES or time.monotonic() - self._flushed_at >= TOUCH_FLUSH_SECONDS:
+            self._flush_touches()
+
+    def _flush_touches(self) -> None:
+        self._flushed_at = time.monotonic()
+        if not self._touched:
+            return
+        self._db.executemany(
+            "UPDATE entries SET accessed = ?, hits = hits + ? WHERE key = ?",
+            [(accessed, hits, key) for key, (accessed, hits) in self._touched.items()],
+        )
+        self._db.commit()
+        self._touched.clear()
+
+    def _refresh_totals(self) -> None:
+        self._count, self._bytes = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        self._totals_at = time.monotonic()
+
+    def _insert(self, key: str, dataset: str, kind: str, size: int, payload) -> None:
+        now = time.time()
+        self._db.execute(
+            "INSERT OR REPLACE INTO entries (key, dataset, kind, size, created, accessed, hits, payload)"
+            " VALUES (?, ?, ?, ?, ?, ?, 0, ?)",
+            (key, dataset, kind, size, now, now, payload),
+        )
+        self._db.commit()
+        self._touched.pop(key, None)
+        # A replaced key is counted twice until the next exact refresh; that only evicts early
+        self._count += 1
+        self._bytes += size
+
+    def _evict(self) -> None:
+        if time.monotonic() - self._totals_at >= TOTALS_REFRESH_SECONDS:
+            self._refresh_totals()
+        if self._count <= self.max_entries and self._bytes <= self.max_bytes:
+            return
+
+        # Over the limit by the running totals: order by up-to-date access times and exact sizes
+        self._flush_touches()
+        self._refresh_totals()
+        count, size = self._count, self._bytes
+        if count <= self.max_entries and size <= self.max_bytes:
+            return
+
+        victims = []
+        for key, kind, entry_size in self._db.execute("SELECT key, kind, size FROM entries ORDER BY accessed ASC"):
+            if count <= self.max_entries and size <= self.max_bytes:
+                break
+            victims.append((key, kind))
+            count -= 1
+            size -= entry_size
+
+        for key, kind in victims:
+            self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self._memory.pop(key, None)
+            if kind == "frame":
+                try:
+                    os.remove(self._frame_path(key))
+                except FileNotFoundError:
+                    pass
+        self._db.commit()
+        self._count, self._bytes = count, size
@@ -0,0 +1,204 @@
+from __future__ import annotations
+
+import os
+import threading
+
+from config import PARQUET_FILE, COUNTERPARTY_FACTS_FILE, COUNTERPARTY_FACTS_PARQUET_FILE, DIMENSION_FILES
+from services.file_handler import iter_dataset_batches, load_dataset, read_ipc_mmap, scan_dataset, staged_path, use_streaming
+from services.lazy import lazy_import
+from services.snapshots import resolve
+from services.summaries import AMOUNT_COL, COUNTERPARTY_GROUPINGS, COUNTERPARTY_KEYS
+
+pl = lazy_import("polars")
+pa = lazy_import("pyarrow")
+pq = lazy_import("pyarrow.parquet")
+
+# Ledger columns the aggregate queries need besides the counterparty keys
+FACT_COLUMNS = ["G/L Account", "Business Area", "Posting Date", AMOUNT_COL]
+
+# Hierarchy keys below Business Area, carried when the extract has them
+OPTIONAL_FACT_COLUMNS = ["Profit Center", "Cost Center"]
+
+# Rows per batch when the fact files are written from a lazy ledger
+FACT_BATCH_ROWS = 100_000
+
+# Every file build() writes
+BUILT_FILES = [COUNTERPARTY_FACTS_FILE, COUNTERPARTY_FACTS_PARQUET_FILE, *DIMENSION_FILES.values()]
+
+_loaded = {"stamp": None, "facts": None}
+_dimensions = {"stamp": None, "tables": None}
+_loaded_lock = threading.Lock()
+
+
+# ========== Build ==========
+def _normalized(col: str):
+    """Trimmed text, with blanks and nulls folded into "Others"."""
+    value = pl.col(col).cast(pl.String).str.strip_chars()
+    return pl.when(value.is_null() | (value == "")).then(pl.lit("Others")).otherwise(value).alias(col)
+
+
+def _with_counterparty_columns(df: pl.DataFrame | pl.LazyFrame) -> pl.DataFrame | pl.LazyFrame:
+    present = df.collect_schema().names()
+    columns = [c for grouping in COUNTERPARTY_GROUPINGS.values() for c in grouping]
+    return df.with_columns([
+        _normalized(c) if c in present else pl.lit("Others").alias(c) for c in columns
+    ])
+
+
+def _dimension(df: pl.DataFrame | pl.LazyFrame, name: str) -> pl.DataFrame | pl.LazyFrame:
+    key = COUNTERPARTY_KEYS[name]
+    code, *label = COUNTERPARTY_GROUPINGS[name]
+    if label:
+        # One name per code: the most frequent real name, "Others" only if there is none
+        label = label[0]
+        dim = (
+            df.group_by([code, label]).len()
+            .sort([code, pl.col(label) == "Others", "len", label], descending=[False, False, True, False])
+            .group_by(code, maintain_order=True).first()
+            .select([
+                code,
+                pl.when(pl.col(code) == "Others").then(pl.lit("Others")).otherwise(pl.col(label)).alias(label),
+            ])
+        )
+    else:
+        dim = df.select(code).unique().sort(code)
+    return dim.with_row_index(key).with_columns(pl.col(key).cast(pl.UInt32))
+
+
+def _target(path: str, staging_dir: str) -> str:
+    return staged_path(staging_dir, path) if staging_dir else resolve(path)
+
+
+def _write(df: pl.DataFrame, path: str) -> None:
+    """Uncompressed Arrow IPC, or Parquet when the path says so."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    if path.endswith(".parquet"):
+        df.write_parquet(tmp_path)
+    else:
+        df.write_ipc(tmp_path, compression="uncompressed")
+    os.replace(tmp_path, path)
+
+
+def _keyed(facts: pl.DataFrame, lookups: list) -> pl.DataFrame:
+    """Swap each counterparty code for its dimension key."""
+    for lookup in lookups:
+        code = lookup.columns[0]
+        facts = facts.join(lookup, on=code, how="left", maintain_order="left").drop(code)
+    return facts
+
+
+def _write_in_batches(batches, columns: list, lookups: list, parquet_path: str, ipc_path: str) -> None:
+    """Both fact files from ledger batches, never holding more than one.
+
+    Polars' sinks buffer close to their whole output, so streaming ingest and
+    on-demand builds append batches through pyarrow writers instead.
+    """
+    tmp_parquet, tmp_ipc = f"{parquet_path}.{os.getpid()}.tmp", f"{ipc_path}.{os.getpid()}.tmp"
+    parquet_writer = ipc_writer = None
+    try:
+        for batch in batches:
+            table = _keyed(_with_counterparty_columns(batch).select(columns), lookups).to_arrow()
+            if parquet_writer is None:
+                parquet_writer = pq.ParquetWriter(tmp_parquet, table.schema, compression="zstd")
+                ipc_writer = pa.ipc.new_file(tmp_ipc, table.schema)
+            parquet_writer.write_table(table)
+            ipc_writer.write_table(table)
+    finally:
+        if parquet_writer is not None:
+            parquet_writer.close()
+            ipc_writer.close()
+    os.replace(tmp_parquet, parquet_path)
+    os.replace(tmp_ipc, ipc_path)
+
+
+def build(df: pl.DataFrame | pl.LazyFrame = None, staging_dir: str = None) -> None:
+    """Write the dimension tables and the key-only fact files (run at ingest, or on demand).
+
+    A LazyFrame must be a scan of the ledger in `staging_dir`, or of the current one.
+    """
+    if df is None:
+        df = scan_dataset() if use_streaming() else load_dataset()
+
+    optional = [c for c in OPTIONAL_FACT_COLUMNS if c in df.collect_schema().names()]
+    df = _with_counterparty_columns(df)
+    codes = [grouping[0] for grouping in COUNTERPARTY_GROUPINGS.values()]
+    lookups = []
+    for name, path in DIMENSION_FILES.items():
+        dim = _dimension(df, name)
+        if isinstance(dim, pl.LazyFrame):
+            dim = dim.collect(engine="streaming")
+        _write(dim, _target(path, staging_dir))
+        lookups.append(dim.select([COUNTERPARTY_GROUPINGS[name][0], COUNTERPARTY_KEYS[name]]))
+
+    columns = FACT_COLUMNS + optional + codes
+    parquet_path = _target(COUNTERPARTY_FACTS_PARQUET_FILE, staging_dir)
+    ipc_path = _target(COUNTERPARTY_FACTS_FILE, staging_dir)
+    if isinstance(df, pl.LazyFrame):
+        _write_in_batches(iter_dataset_batches(FACT_BATCH_ROWS, staging_dir), columns, lookups, parquet_path, ipc_path)
+    else:
+        facts = _keyed(df.select(columns), lookups)
+        _write(facts, parquet_path)
+        _write(facts, ipc_path)
+
+
+def _is_current() -> bool:
+    parquet_mtime = os.stat(resolve(PARQUET_FILE)).st_mtime_ns
+    return all(
+        os.path.exists(resolve(path)) and os.stat(resolve(path)).st_mtime_ns >= parquet_mtime
+        for path in BUILT_FILES
+    )
+
+
+def _has_layout(columns: list) -> bool:
+    """False for fact files written before the ledger's optional columns were carried."""
+    ledger = scan_dataset().collect_schema().names()
+    return all(c in columns for c in OPTIONAL_FACT_COLUMNS if c in ledger)
+
+
+# ========== Load ==========
+def _stamp(path: str) -> str:
+    st = os.stat(resolve(path))
+    return f"{st.st_size}-{st.st_mtime_ns}"
+
+
+def _ensure_current() -> None:
+    if not _is_current():
+        build()
+
+
+def load():
+    """(facts, {name: dimension}) memory-mapped, rebuilt if the ledger changed without them."""
+    with _loaded_lock:
+        _ensure_current()
+        stamp = _stamp(COUNTERPARTY_FACTS_FILE)
+        if _loaded["stamp"] != stamp:
+            facts = read_ipc_mmap(resolve(COUNTERPARTY_FACTS_FILE))
+            if not _has_layout(facts.columns):
+                build()
+                stamp = _stamp(COUNTERPARTY_FACTS_FILE)
+                facts = read_ipc_mmap(resolve(COUNTERPARTY_FACTS_FILE))
+            _loaded["facts"] = facts
+            _loaded["stamp"] = stamp
+        facts = _loaded["facts"]
+    return facts, dimension_tables()
+
+
+def scan_facts() -> pl.LazyFrame:
+    """Streaming-mode facts: a Parquet scan, read a row group at a time."""
+    with _loaded_lock:
+        _ensure_current()
+        path = resolve(COUNTERPARTY_FACTS_PARQUET_FILE)
+        if not _has_layout(list(pl.read_parquet_schema(path))):
+            build()
+    return pl.scan_parquet(path)
+
+
+def dimension_tables() -> dict:
+    """{name: dimension}; only the small dimension files are mapped, never the facts."""
+    with _loaded_lock:
+        _ensure_current()
+        stamp = "|".join(_stamp(path) for path in DIMENSION_FILES.values())
+        if _dimensions["stamp"] != stamp:
+            _dimensions["tables"] = {name: read_ipc_mmap(resolve(path)) for name, path in DIMENSION_FILES.items()}
+            _dimensions["stamp"] = stamp
+        return _dimensions["tables"]
@@ -0,0 +1,137 @@
+from __future__ import annotations
+
+import io
+import os
+import tempfile
+
+from config import EXPORT_CHUNK_ROWS
+from services.file_handler import iter_dataset_batches
+from services.filters import gl_filter, drill_filter
+from services.lazy import lazy_import
+from services.transformations import derive_columns
+
+pl = lazy_import("polars")
+pa = lazy_import("pyarrow")
+
+# format -> (media type, file extension)
+EXPORT_FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+    "xlsx": ("application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", "xlsx"),
+}
+
+XLSX_MAX_ROWS = 1_048_576
+
+
+def iter_line_items(gl_account: str, ageing: str, division: str, business_area: str, current_date: str):
+    """Rows behind a Drilldown IV cell, one chunk at a time.
+
+    Empty chunks are yielded too so writers always know the output schema.
+    """
+    for chunk in iter_dataset_batches(EXPORT_CHUNK_ROWS):
+        chunk = chunk.filter(gl_filter(gl_account))
+        chunk = derive_columns(chunk, current_date)
+        chunk = chunk.filter(drill_filter(ageing, division, business_area))
+        yield chunk.drop("AgeDays")
+
+
+# ========== Writers ==========
+def stream_csv(chunks):
+    header_written = False
+    schema_chunk = None
+    for chunk in chunks:
+        if chunk.height == 0:
+            schema_chunk = chunk
+            continue
+        buf = io.BytesIO()
+        chunk.write_csv(buf, include_header=not header_written)
+        header_written = True
+        yield buf.getvalue()
+
+    if not header_written and schema_chunk is not None:
+        buf = io.BytesIO()
+        schema_chunk.write_csv(buf)
+        yield buf.getvalue()
+
+
+class _DrainableSink(io.RawIOBase):
+    """Write-only file object whose contents are handed out and dropped as we go."""
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._buffer.extend(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self) -> bytes:
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+
+def stream_parquet(chunks):
+    import pyarrow.parquet as pq
+
+    sink = _DrainableSink()
+    writer = None
+    schema_chunk = None
+    for chunk in chunks:
+        if chunk.height == 0:
+            schema_chunk = chunk
+            continue
+        table = chunk.to_arrow()
+        if writer is None:
+            writer = pq.ParquetWriter(sink, table.schema)
+        writer.write_table(table.cast(writer.schema))
+        yield sink.drain()
+
+    if writer is None:
+        table = schema_chunk.to_arrow() if schema_chunk is not None else pa.table({})
+        writer = pq.ParquetWriter(sink, table.schema)
+    writer.close()
+    yield sink.drain()
+
+
+def stream_xlsx(chunks):
+    # xlsx is a zip archive, so it cannot be emitted before it is complete. xlsxwriter's
+    # constant_memory mode flushes each row to a temp file, keeping memory flat; the
+    # finished file is then streamed back in blocks.
+    import xlsxwriter
+
+    fd, path = tempfile.mkstemp(suffix=".xlsx")
+    os.close(fd)
+    try:
+        workbook = xlsxwriter.Workbook(path, {"constant_memory": True})
+        sheet, row, columns = None, XLSX_MAX_ROWS, []
+        for chunk in chunks:
+            chunk = chunk.with_columns(pl.col(pl.Date, pl.Datetime).cast(pl.String))
+            columns = chunk.columns
+            for values in chunk.iter_rows():
+                # Roll over to a new sheet at Excel's row limit
+                if row >= XLSX_MAX_ROWS:
+                    sheet = workbook.add_worksheet()
+                    sheet.write_row(0, 0, columns)
+                    row = 1
+                sheet.write_row(row, 0, values)
+                row += 1
+        if sheet is None:
+            workbook.add_worksheet().write_row(0, 0, columns)
+        workbook.close()
+
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                yield block
+    finally:
+        os.remove(path)
+
+
+WRITERS = {"csv": stream_csv, "parquet": stream_parquet, "xlsx": stream_xlsx}
@@ -0,0 +1,181 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+from config import PARQUET_FILE, MAPPING_FILE, IPC_FILE, QUERY_MODE, STREAMING_THRESHOLD_BYTES, SHARED_DATASET
+from services.lazy import lazy_import
+from services.snapshots import resolve
+
+pl = lazy_import("polars")
+pa = lazy_import("pyarrow")
+
+# (st_dev, st_ino, size, mtime_ns) -> sha256. Keyed by the file rather than its path,
+# so the hard-linked copies of one file in successive snapshots are hashed once.
+_digests = OrderedDict()
+_digests_lock = threading.Lock()
+_MAX_DIGESTS = 64
+
+# The current ledger, kept resident between requests
+_resident = {"digest": None, "df": None}
+_resident_lock = threading.Lock()
+
+
+def _identity(path: str):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+def _remember(identity: tuple, digest: str) -> None:
+    with _digests_lock:
+        _digests[identity] = digest
+        _digests.move_to_end(identity)
+        while len(_digests) > _MAX_DIGESTS:
+            _digests.popitem(last=False)
+
+
+def file_digest(path: str):
+    """Content hash of a file, re-read only when the file itself changes."""
+    identity = _identity(path)
+    if identity is None:
+        return None
+    cached = _digests.get(identity)
+    if cached is not None:
+        return cached
+
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    digest = h.hexdigest()
+    _remember(identity, digest)
+    return digest
+
+
+def seed_digest(path: str, stamp: tuple, digest: str) -> None:
+    """Record a digest computed elsewhere (e.g. by the process that published it).
+
+    Ignored unless `path` still has the (size, mtime_ns) the digest was taken at.
+    """
+    identity = _identity(path)
+    if identity is not None and identity[2:] == tuple(stamp):
+        _remember(identity, digest)
+
+
+def dataset_key():
+    """Identifies the current data + mapping pair. None when nothing is uploaded."""
+    data = file_digest(resolve(PARQUET_FILE))
+    if data is None:
+        return None
+    mapping = file_digest(resolve(MAPPING_FILE)) or "no-mapping"
+    return hashlib.sha256(f"{data}:{mapping}".encode()).hexdigest()[:32]
+
+
+# ========== Storage ==========
+def staged_path(staging_dir: str, live_path: str) -> str:
+    return os.path.join(staging_dir, os.path.basename(live_path))
+
+
+def write_store(df: pl.DataFrame | pl.LazyFrame, storage: str, staging_dir: str) -> None:
+    """Write the Parquet archive and, for the IPC formats, the fast-loading copy.
+
+    A LazyFrame is streamed to disk without being materialised. Files go to
+    `staging_dir` and only become visible once it is published as a snapshot.
+    """
+    parquet_path = staged_path(staging_dir, PARQUET_FILE)
+    if isinstance(df, pl.LazyFrame):
+        df.sink_parquet(parquet_path)
+    else:
+        df.write_parquet(parquet_path)
+
+    if storage in ("ipc", "ipc_lz4"):
+        compression = "lz4" if storage == "ipc_lz4" else "uncompressed"
+        if isinstance(df, pl.LazyFrame):
+            pl.scan_parquet(parquet_path).sink_ipc(staged_path(staging_dir, IPC_FILE), compression=compression)
+        else:
+            df.write_ipc(staged_path(staging_dir, IPC_FILE), compression=compression)
+
+
+def _ipc_is_current() -> bool:
+    ipc_file, parquet_file = resolve(IPC_FILE), resolve(PARQUET_FILE)
+    if not os.path.exists(ipc_file) or not os.path.exists(parquet_file):
+        return False
+    return os.stat(ipc_file).st_mtime_ns >= os.stat(parquet_file).st_mtime_ns
+
+
+def read_ipc_mmap(path: str) -> pl.DataFrame:
+    """Open an Arrow IPC file through a memory map.
+
+    Uncompressed buffers are used in place, so the load is near-instant and the
+    pages live in the shared OS page cache. LZ4 files are decompressed on read.
+    """
+    with pa.memory_map(path, "r") as source:
+        table = pa.ipc.open_file(source).read_all()
+    return pl.from_arrow(table, rechunk=False)
+
+
+def storage_format() -> str:
+    return "ipc" if _ipc_is_current() else "parquet"
+
+
+def use_streaming() -> bool:
+    """Whether queries should scan the store instead of using the resident frame."""
+    if QUERY_MODE == "streaming":
+        return True
+    parquet_file = resolve(PARQUET_FILE)
+    if QUERY_MODE == "eager" or not os.path.exists(parquet_file):
+        return False
+    return os.path.getsize(parquet_file) > STREAMING_THRESHOLD_BYTES
+
+
+def streams_ingest(source_bytes: int) -> bool:
+    """Whether an upload of this size is converted with lazy scans instead of in memory."""
+    if QUERY_MODE != "auto":
+        return QUERY_MODE == "streaming"
+    return source_bytes > STREAMING_THRESHOLD_BYTES
+
+
+def scan_dataset() -> pl.LazyFrame:
+    """Lazy scan of the ledger; nothing is read until the plan is collected."""
+    if _ipc_is_current():
+        return pl.scan_ipc(resolve(IPC_FILE))
+    return pl.scan_parquet(resolve(PARQUET_FILE))
+
+
+def iter_dataset_batches(batch_rows: int, staging_dir: str = None):
+    """Yield the ledger in row batches without materialising more than one batch.
+
+    Reads the store in either query mode, so the whole ledger is never resident.
+    With `staging_dir`, the ledger being ingested there rather than the current one.
+    """
+    if not staging_dir and _ipc_is_current():
+        # Slices of a memory-mapped file are views; pages are faulted in on demand
+        yield from read_ipc_mmap(resolve(IPC_FILE)).iter_slices(batch_rows)
+        return
+
+    import pyarrow.parquet as pq
+    path = staged_path(staging_dir, PARQUET_FILE) if staging_dir else resolve(PARQUET_FILE)
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_rows):
+        yield pl.from_arrow(batch)
+
+
+def load_dataset() -> pl.DataFrame:
+    """The uploaded ledger, read once per upload and shared by all requests."""
+    if SHARED_DATASET:
+        from services import shared_dataset  # imports this module
+        return shared_dataset.attach()
+
+    digest = file_digest(resolve(PARQUET_FILE))
+    with _resident_lock:
+        if _resident["df"] is None or _resident["digest"] != digest:
+            if _ipc_is_current():
+                _resident["df"] = read_ipc_mmap(resolve(IPC_FILE))
+            else:
+                _resident["df"] = pl.read_parquet(resolve(PARQUET_FILE))
+            _resident["digest"] = digest
+        return _resident["df"]
@@ -0,0 +1,23 @@
+from __future__ import annotations
+
+from services.lazy import lazy_import
+
+pl = lazy_import("polars")
+
+
+def gl_filter(gl_account: str):
+    return pl.col("G/L Account") == gl_account
+
+
+def drill_filter(ageing: str = None, division: str = None, business_area: str = None):
+    """AND of the drilldown selections that are set; applied after derive_columns."""
+    conditions = []
+    if ageing is not None:
+        conditions.append(pl.col("Ageing") == ageing)
+    if division is not None:
+        conditions.append(pl.col("Division") == division)
+    if business_area is not None:
+        conditions.append(pl.col("Business Area") == business_area)
+    if not conditions:
+        return pl.lit(True)
+    return pl.all_horizontal(conditions)
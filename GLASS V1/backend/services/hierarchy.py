@@ -0,0 +1,139 @@
+from __future__ import annotations
+
+from config import MAPPING_FILE, HIERARCHY_LEAF_KEYS, HIERARCHY_LEVELS
+from services.file_handler import file_digest
+from services.lazy import lazy_import
+from services.snapshots import resolve
+
+pl = lazy_import("polars")
+
+# The compiled mapping, rebuilt only when the mapping file changes
+_compiled = {"digest": None, "hierarchy": None}
+
+
+def read_mapping(path: str) -> pl.DataFrame:
+    # Sniff the content rather than trusting the name: CSV uploads are stored under MAPPING_FILE too
+    with open(path, "rb") as f:
+        is_xlsx = f.read(4) == b"PK\x03\x04"
+    if is_xlsx:
+        return pl.read_excel(path)
+    return pl.read_csv(path)
+
+
+def _text(col: str):
+    value = pl.col(col).cast(pl.String).str.strip_chars()
+    return pl.when(value == "").then(None).otherwise(value).alias(col)
+
+
+def compile_mapping(mapping_df: pl.DataFrame) -> dict:
+    """Flatten a mapping file into one lookup per leaf key.
+
+    Each lookup row carries the full path (Division, Segment, Region) for one
+    Cost Center, Profit Center or Business Area. Levels a row leaves blank are
+    filled from other rows that state the parent of the level below. Raises
+    ValueError when the file is not a tree.
+    """
+    leaves = [c for c in HIERARCHY_LEAF_KEYS if c in mapping_df.columns]
+    levels = [c for c in HIERARCHY_LEVELS if c in mapping_df.columns]
+    if not leaves:
+        raise ValueError(f"Mapping needs one of the columns: {', '.join(HIERARCHY_LEAF_KEYS)}")
+    if "Division" not in levels:
+        raise ValueError("Mapping needs a Division column")
+
+    df = mapping_df.select([_text(c) for c in leaves + levels])
+
+    for child, parent in zip(levels, levels[1:]):
+        parents = df.filter(pl.col(child).is_not_null() & pl.col(parent).is_not_null()).select([child, parent]).unique()
+        conflicts = parents.group_by(child).len().filter(pl.col("len") > 1)
+        if conflicts.height:
+            raise ValueError(f"{child} '{conflicts[child][0]}' belongs to more than one {parent}")
+        df = (
+            df.join(parents.rename({parent: "_parent"}), on=child, how="left")
+            .with_columns(pl.coalesce([parent, "_parent"]).alias(parent))
+            .drop("_parent")
+        )
+
+    lookups = {}
+    for leaf in leaves:
+        lookup = df.filter(pl.col(leaf).is_not_null() & pl.col("Division").is_not_null()).select([leaf] + levels).unique()
+        conflicts = lookup.group_by(leaf).len().filter(pl.col("len") > 1)
+        if conflicts.height:
+            raise ValueError(f"{leaf} '{conflicts[leaf][0]}' is mapped to more than one Division")
+        lookups[leaf] = lookup
+
+    return {"levels": levels, "leaf_keys": leaves, "lookups": lookups}
+
+
+def load():
+    """The compiled hierarchy, or None when no mapping is uploaded."""
+    mapping_file = resolve(MAPPING_FILE)
+    digest = file_digest(mapping_file)
+    if digest is None:
+        return None
+    if _compiled["digest"] != digest:
+        _compiled["hierarchy"] = compile_mapping(read_mapping(mapping_file))
+        _compiled["digest"] = digest
+    return _compiled["hierarchy"]
+
+
+def levels() -> list:
+    hierarchy = load()
+    return hierarchy["levels"] if hierarchy is not None else ["Division"]
+
+
+# ========== Applying the mapping ==========
+def attach(df: pl.DataFrame | pl.LazyFrame) -> pl.DataFrame | pl.LazyFrame:
+    """Add Division (and Segment/Region when mapped), "Others" where nothing matches."""
+    hierarchy = load()
+    if hierarchy is None:
+        return df.with_columns([pl.lit("Others").alias("Division")])
+
+    schema = df.collect_schema()
+    matched = []
+    for leaf in hierarchy["leaf_keys"]:
+        if leaf not in schema:
+            continue
+        lookup = hierarchy["lookups"][leaf].with_columns(pl.col(leaf).cast(schema[leaf], strict=False))
+        lookup = lookup.rename({level: f"{level}|{leaf}" for level in hierarchy["levels"]})
+        if isinstance(df, pl.LazyFrame):
+            lookup = lookup.lazy()
+        # Keep row order: line-item paging relies on the index order surviving the filter
+        df = df.join(lookup, on=leaf, how="left", maintain_order="left")
+        matched.append(leaf)
+
+    # Take the whole path from the most specific key that matched, never mix them
+    resolved = []
+    for level in hierarchy["levels"]:
+        expr = None
+        for leaf in matched:
+            found = pl.col(f"Division|{leaf}").is_not_null()
+            expr = pl.when(found).then(pl.col(f"{level}|{leaf}")) if expr is None else expr.when(found).then(pl.col(f"{level}|{leaf}"))
+        expr = pl.lit(None, pl.String) if expr is None else expr.otherwise(None)
+        resolved.append(expr.fill_null("Others").alias(level))
+
+    return df.with_columns(resolved).drop([f"{level}|{leaf}" for leaf in matched for level in hierarchy["levels"]])
+
+
+def level_filter(df: pl.DataFrame, level: str, value: str) -> pl.DataFrame:
+    """Rows of `df` under one hierarchy node, without keeping the level columns."""
+    columns = df.columns
+    return attach(df).filter(pl.col(level) == value).select(columns)
+
+
+# ========== Roll-ups ==========
+def rollups(cube: pl.DataFrame, total_col: str = "Total Amount") -> dict:
+    """Totals at every level, top-down, each row carrying its full path.
+
+    Computed once per cube, so drilling up or down the hierarchy is a lookup
+    in the table for the requested level rather than another join.
+    """
+    path = list(reversed([level for level in levels() if level in cube.columns])) + ["Business Area"]
+    tables = {}
+    for depth, level in enumerate(path, start=1):
+        keys = path[:depth]
+        tables[level] = (
+            cube.group_by(keys).agg(pl.col(total_col).sum().alias("Total Amount"))
+            .sort(keys)
+            .to_dicts()
+        )
+    return {"levels": path, "tables": tables}
@@ -0,0 +1,186 @@
+from __future__ import annotations
+
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from config import JOBS_DIR, REQUIRED_COLUMNS, SHARED_DATASET, PARQUET_FILE, MAPPING_FILE
+from services import dimensions, line_items, movements, shared_dataset, snapshots
+from services.file_handler import staged_path, streams_ingest, write_store
+from services.lazy import lazy_import
+
+pl = lazy_import("polars")
+pq = lazy_import("pyarrow.parquet")
+
+STAGES = ["save", "parse", "validate", "write store", "build indexes", "publish", "pre-aggregate"]
+
+# One ingest at a time per process; queries keep running against their pinned snapshot
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="upload-job")
+_jobs = {}
+_lock = threading.Lock()
+
+
+def _job_file(job_id: str) -> str:
+    return os.path.join(JOBS_DIR, f"{job_id}.json")
+
+
+def _upload_file(job_id: str) -> str:
+    # Per job, so a second upload with the same name cannot overwrite one still being parsed
+    return os.path.join(JOBS_DIR, f"{job_id}.csv")
+
+
+def _persist(job: dict) -> None:
+    # Written to disk so any worker process can answer a status request
+    os.makedirs(JOBS_DIR, exist_ok=True)
+    tmp_path = f"{_job_file(job['job_id'])}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(job, f)
+    os.replace(tmp_path, _job_file(job["job_id"]))
+
+
+def _update(job_id: str, persist: bool = True, **fields) -> dict:
+    with _lock:
+        job = _jobs[job_id]
+        job.update(fields)
+        elapsed = (job["finished_at"] or time.time()) - job["started_at"]
+        if elapsed > 0:
+            job["bytes_per_second"] = round(job["bytes_processed"] / elapsed)
+            job["rows_per_second"] = round(job["rows"] / elapsed)
+        snapshot = dict(job)
+    if persist:
+        _persist(snapshot)
+    return snapshot
+
+
+def _enter_stage(job_id: str, stage: str) -> None:
+    _update(job_id, stage=stage, progress=round(STAGES.index(stage) / len(STAGES), 2))
+
+
+def create(filename: str, bytes_total: int, storage: str) -> dict:
+    job = {
+        "job_id": uuid.uuid4().hex,
+        "filename": filename,
+        "storage": storage,
+        "state": "running",   # running -> succeeded | failed
+        "stage": None,
+        "progress": 0.0,
+        "bytes_total": bytes_total,
+        "bytes_processed": 0,
+        "rows": 0,
+        "bytes_per_second": 0,
+        "rows_per_second": 0,
+        "started_at": time.time(),
+        "finished_at": None,
+        "error": None,
+    }
+    with _lock:
+        _jobs[job["job_id"]] = job
+    _persist(job)
+    return dict(job)
+
+
+def save(job_id: str, source) -> str:
+    """Copy the request body to disk, counting bytes as they land."""
+    _enter_stage(job_id, "save")
+    os.makedirs(JOBS_DIR, exist_ok=True)
+    path = _upload_file(job_id)
+    copied = 0
+    last_persist = 0
+    with open(path, "wb") as f:
+        for block in iter(lambda: source.read(1024 * 1024), b""):
+            f.write(block)
+            copied += len(block)
+            persist = copied - last_persist >= 16 * 1024 * 1024
+            if persist:
+                last_persist = copied
+            _update(job_id, persist=persist, bytes_processed=copied)
+    _update(job_id, bytes_processed=copied, bytes_total=copied)
+    return path
+
+
+def submit(job_id: str, csv_path: str, storage: str) -> None:
+    _executor.submit(_run, job_id, csv_path, storage)
+
+
+def fail(job_id: str, error: str) -> None:
+    _update(job_id, state="failed", error=error, finished_at=time.time())
+    if os.path.exists(_upload_file(job_id)):
+        os.remove(_upload_file(job_id))
+
+
+def _run(job_id: str, csv_path: str, storage: str) -> None:
+    staging_dir = snapshots.new_staging_dir()
+    # Ledgers past the streaming threshold never go through memory as a whole
+    streaming = streams_ingest(os.path.getsize(csv_path))
+    try:
+        _enter_stage(job_id, "parse")
+        if streaming:
+            df = pl.scan_csv(csv_path, separator=";")
+        else:
+            df = pl.read_csv(csv_path, separator=";")
+            rows = df.height
+            _update(job_id, rows=rows)
+            os.remove(csv_path)
+
+        _enter_stage(job_id, "validate")
+        missing = [c for c in REQUIRED_COLUMNS if c not in df.collect_schema().names()]
+        if missing:
+            raise ValueError(f"Missing required columns: {', '.join(missing)}")
+        if not streaming and rows == 0:
+            raise ValueError("The file contains no rows")
+
+        _enter_stage(job_id, "write store")
+        write_store(df, storage, staging_dir)
+        if streaming:
+            os.remove(csv_path)
+            # Later stages read the converted store, not the CSV
+            df = pl.scan_parquet(staged_path(staging_dir, PARQUET_FILE))
+            rows = pq.ParquetFile(staged_path(staging_dir, PARQUET_FILE)).metadata.num_rows
+            _update(job_id, rows=rows)
+            if rows == 0:
+                raise ValueError("The file contains no rows")
+
+        _enter_stage(job_id, "build indexes")
+        line_items.build_index(df, staging_dir)
+        dimensions.build(df, staging_dir)
+
+        _enter_stage(job_id, "publish")
+        # The new snapshot keeps the current mapping; its data files are all new
+        published = snapshots.publish(staging_dir, carry=[MAPPING_FILE])
+        with snapshots.pinned() as snapshot:
+            if SHARED_DATASET and not streaming:
+                # A newer upload may already have replaced this one; then `df` is not its ledger
+                shared_dataset.publish(df if snapshot == published["snapshot"] else None)
+
+            # Kept after newer uploads replace this one, for variance at any reference date
+            _enter_stage(job_id, "pre-aggregate")
+            try:
+                movements.build()
+            except Exception as e:
+                # Published already; the live version's movements are rebuilt on first use
+                print(f"[WARN] Movement pre-aggregate for job {job_id} failed: {e}")
+
+        _update(job_id, state="succeeded", stage="done", progress=1.0, finished_at=time.time())
+    except Exception as e:
+        print(f"[WARN] Upload job {job_id} failed: {e}")
+        fail(job_id, str(e))
+    finally:
+        # Gone already once published; left over only when a stage failed
+        shutil.rmtree(staging_dir, ignore_errors=True)
+
+
+def status(job_id: str):
+    if not job_id.isalnum():
+        return None
+    with _lock:
+        if job_id in _jobs:
+            return dict(_jobs[job_id])
+    try:
+        with open(_job_file(job_id)) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
@@ -0,0 +1,30 @@
+import importlib
+
+
+class LazyModule:
+    """Stand-in for a module that is only imported on first attribute access.
+
+    Keeps heavy or optional dependencies (polars, pyarrow, google.generativeai)
+    out of worker boot. Modules using it for annotations need
+    `from __future__ import annotations`.
+    """
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<lazy module '{self._name}' ({state})>"
+
+
+def lazy_import(name: str) -> LazyModule:
+    return LazyModule(name)
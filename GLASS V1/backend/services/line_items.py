@@ -0,0 +1,303 @@
+from __future__ import annotations
+
+import base64
+import json
+import os
+import tempfile
+import threading
+from datetime import date
+
+from config import PARQUET_FILE, LINE_ITEM_INDEX_FILE
+from services.file_handler import iter_dataset_batches, load_dataset, read_ipc_mmap, scan_dataset, staged_path, use_streaming
+from services.lazy import lazy_import
+from services import hierarchy
+from services.snapshots import resolve
+from services.transformations import ageing_date_range
+
+pl = lazy_import("polars")
+pa = lazy_import("pyarrow")
+
+# Sort order of the index; (G/L, Business Area) ranges are contiguous and dated within them.
+# Document Number is optional: without it, ties keep their order in the extract.
+INDEX_KEY = ["G/L Account", "Business Area", "Posting Date", "Document Number"]
+
+# Leading INDEX_KEY columns an out-of-core build sorts one partition at a time
+PARTITION_KEY = INDEX_KEY[:2]
+
+# Rows per sorted run when the index is built from a lazy ledger
+INDEX_RUN_ROWS = 250_000
+
+# BELNR, BLDAT, BUDAT, HSL, SGTXT, LIFNR, KUNNR, ... as they are named in the extract
+LINE_ITEM_COLUMNS = [
+    "G/L Account", "Business Area", "Posting Date", "Document Number", "Document Date",
+    "Document Type", "Amount in Local Currency", "Text", "Vendor Code", "Vendor Name",
+    "Customer Code", "Customer Name", "Reference", "Profit Center", "Cost Center",
+]
+
+SORTABLE_COLUMNS = [
+    "Posting Date", "Document Number", "Document Date", "Amount in Local Currency",
+    "Vendor Code", "Customer Code", "Document Type",
+]
+
+_index = {"stamp": None, "df": None}
+_index_lock = threading.Lock()
+
+
+# ========== Build ==========
+def _index_rows(frame):
+    columns = [c for c in LINE_ITEM_COLUMNS if c in frame.collect_schema().names()]
+    return frame.select(columns).with_columns(
+        pl.col("Posting Date").str.strptime(pl.Date, format="%Y-%m-%d", strict=False)
+    )
+
+
+def _sorted(frame, key: list):
+    return frame.sort(key, nulls_last=True, maintain_order=True)
+
+
+def _index_plan(frame):
+    frame = _index_rows(frame)
+    return _sorted(frame, [c for c in INDEX_KEY if c in frame.collect_schema().names()]).with_row_index("_row")
+
+
+def _write_runs(batches, run_dir: str) -> list:
+    """Sort each ledger batch into a run file, one record batch per (G/L, Business Area).
+
+    Returns (path, partition keys in file order) per run, in ledger order.
+    """
+    runs = []
+    for number, batch in enumerate(batches):
+        batch = _index_rows(batch)
+        if batch.height == 0:
+            continue
+        batch = _sorted(batch, [c for c in INDEX_KEY if c in batch.columns])
+        partition_key = [c for c in PARTITION_KEY if c in batch.columns]
+        path = os.path.join(run_dir, f"run-{number}.arrow")
+        with pa.ipc.new_file(path, batch.head(0).to_arrow().schema) as writer:
+            for part in batch.partition_by(partition_key, maintain_order=True):
+                writer.write_table(part.to_arrow())
+        runs.append((path, batch.select(partition_key).unique(maintain_order=True)))
+    return runs
+
+
+def _merge_runs(runs: list, path: str) -> None:
+    """Write the index from sorted runs, one (G/L, Business Area) partition at a time.
+
+    Partitions follow INDEX_KEY's leading columns, so sorting each one on its
+    own and appending them in key order gives the whole index in order.
+    """
+    partition_key = runs[0][1].columns
+    readers = [pa.ipc.open_file(pa.OSFile(run_path)) for run_path, _ in runs]
+    rest = [c for c in INDEX_KEY if c in readers[0].schema.names and c not in partition_key]
+    run_keys = [keys.rows() for _, keys in runs]
+    positions = [0] * len(runs)
+    written = 0
+    writer = None
+    try:
+        for key in _sorted(pl.concat([keys for _, keys in runs]).unique(), partition_key).iter_rows():
+            parts = []
+            for i, keys in enumerate(run_keys):
+                if positions[i] < len(keys) and keys[positions[i]] == key:
+                    parts.append(pl.from_arrow(readers[i].get_batch(positions[i])))
+                    positions[i] += 1
+            # Runs are in ledger order, so ties keep their order in the extract
+            part = _sorted(pl.concat(parts), rest).with_row_index("_row", offset=written)
+            written += part.height
+            table = part.to_arrow()
+            if writer is None:
+                writer = pa.ipc.new_file(path, table.schema)
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def _build_out_of_core(batches, path: str) -> bool:
+    """External sort of the ledger into `path`; False if the ledger has no rows."""
+    with tempfile.TemporaryDirectory(prefix=".index-runs-", dir=os.path.dirname(path)) as run_dir:
+        runs = _write_runs(batches, run_dir)
+        if not runs:
+            return False
+        _merge_runs(runs, path)
+    return True
+
+
+def build_index(df: pl.DataFrame | pl.LazyFrame = None, staging_dir: str = None) -> None:
+    """Write the sorted line-item index (run at ingest, or on demand if missing).
+
+    A LazyFrame must be a scan of the ledger in `staging_dir`, or of the current
+    one. It is sorted out of core: sorted runs of INDEX_RUN_ROWS rows, merged one
+    (G/L, Business Area) partition at a time, so memory is bounded by the
+    largest partition rather than the ledger.
+    """
+    path = staged_path(staging_dir, LINE_ITEM_INDEX_FILE) if staging_dir else resolve(LINE_ITEM_INDEX_FILE)
+    if df is None:
+        df = scan_dataset() if use_streaming() else load_dataset()
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    if isinstance(df, pl.LazyFrame):
+        if not _build_out_of_core(iter_dataset_batches(INDEX_RUN_ROWS, staging_dir), tmp_path):
+            _index_plan(df.clear()).collect().write_ipc(tmp_path, compression="uncompressed")
+    else:
+        _index_plan(df).write_ipc(tmp_path, compression="uncompressed")
+    os.replace(tmp_path, path)
+
+
+def _index_is_current() -> bool:
+    index_file = resolve(LINE_ITEM_INDEX_FILE)
+    return (
+        os.path.exists(index_file)
+        and os.stat(index_file).st_mtime_ns >= os.stat(resolve(PARQUET_FILE)).st_mtime_ns
+    )
+
+
+def load_index():
+    """The memory-mapped index, rebuilt if the dataset changed without one."""
+    with _index_lock:
+        if not _index_is_current():
+            build_index()
+        index_file = resolve(LINE_ITEM_INDEX_FILE)
+        st = os.stat(index_file)
+        stamp = f"{st.st_size}-{st.st_mtime_ns}"
+        if _index["stamp"] != stamp:
+            _index["df"] = read_ipc_mmap(index_file)
+            _index["stamp"] = stamp
+        return _index["df"], _index["stamp"]
+
+
+# ========== Lookup ==========
+def _as_value(series, value):
+    """Cast a query-string value to the column's dtype (None if it cannot match)."""
+    try:
+        if series.dtype == pl.Date and isinstance(value, str):
+            return date.fromisoformat(value)
+        return pl.Series([value]).cast(series.dtype)[0]
+    except Exception:
+        return None
+
+
+def _equal_range(df, column: str, value):
+    """Rows of a frame sorted on `column` that equal `value`, as a zero-copy slice."""
+    series = df[column]
+    value = _as_value(series, value)
+    if value is None:
+        return df.clear()
+    lo = series.search_sorted(value, side="left")
+    hi = series.search_sorted(value, side="right")
+    return df.slice(lo, hi - lo)
+
+
+def _date_range(df, ageing: str, current_date: str):
+    """Narrow a slice sorted on Posting Date to one Ageing bucket."""
+    first, last, undated = ageing_date_range(ageing, current_date)
+    dates = df["Posting Date"]
+    n_dated = df.height - dates.null_count()  # nulls sort last
+    lo = dates.slice(0, n_dated).search_sorted(first, side="left") if first else 0
+    hi = dates.slice(0, n_dated).search_sorted(last, side="right") if last else n_dated
+    dated = df.slice(lo, hi - lo)
+    if undated and n_dated < df.height:
+        return pl.concat([dated, df.slice(n_dated)])
+    return dated
+
+
+def _ageing_filter(ageing: str, current_date: str):
+    first, last, undated = ageing_date_range(ageing, current_date)
+    condition = pl.lit(True)
+    if first:
+        condition = condition & (pl.col("Posting Date") >= first)
+    if last:
+        condition = condition & (pl.col("Posting Date") <= last)
+    if undated:
+        condition = condition | pl.col("Posting Date").is_null()
+    return condition
+
+
+def encode_cursor(payload: dict) -> str:
+    raw = json.dumps(payload, default=lambda v: v.isoformat() if isinstance(v, date) else str(v))
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> dict:
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        raise ValueError("Malformed cursor")
+
+
+def page(gl_account: str, current_date: str, business_area: str = None, ageing: str = None,
+         division: str = None, document_type: str = None, vendor_code: str = None,
+         customer_code: str = None, search: str = None, sort_by: str = None,
+         descending: bool = False, cursor: str = None, limit: int = 100) -> dict:
+    """One page of line items behind a drilldown node.
+
+    The (G/L, Business Area, ageing) part of the selection is a binary search on
+    the sorted index; remaining filters only touch that slice. Pages continue
+    from an opaque keyset cursor rather than an offset.
+    """
+    if sort_by is not None and sort_by not in SORTABLE_COLUMNS:
+        raise ValueError(f"sort_by must be one of {', '.join(SORTABLE_COLUMNS)}")
+
+    index, version = load_index()
+    if sort_by is not None and sort_by not in index.columns:
+        raise ValueError(f"{sort_by} is not in this dataset")
+    view = _equal_range(index, "G/L Account", gl_account)
+    if business_area is not None:
+        view = _equal_range(view, "Business Area", business_area)
+        if ageing is not None:
+            view = _date_range(view, ageing, current_date)
+    elif ageing is not None:
+        view = view.filter(_ageing_filter(ageing, current_date))
+
+    if division is not None:
+        view = hierarchy.level_filter(view, "Division", division)
+
+    conditions = []
+    for column, value in [("Document Type", document_type), ("Vendor Code", vendor_code), ("Customer Code", customer_code)]:
+        if value is not None:
+            conditions.append(pl.col(column).cast(pl.String) == value)
+    if search:
+        conditions.append(pl.col("Text").str.contains(search, literal=True))
+    if conditions:
+        view = view.filter(pl.all_horizontal(conditions))
+
+    total = view.height
+
+    # Index order already is (Posting Date, Document Number or extract order) inside one business area
+    if sort_by == "Posting Date" and business_area is not None and not descending:
+        sort_by = None
+
+    after = decode_cursor(cursor) if cursor else None
+    if after is not None and after.get("version") != version:
+        raise ValueError("Cursor refers to an older dataset; start again without a cursor")
+
+    if sort_by is None:
+        if after is not None:
+            view = view.slice(view["_row"].search_sorted(after["row"], side="right"))
+        rows = view.head(limit)
+    else:
+        view = view.sort([sort_by, "_row"], descending=[descending, False], nulls_last=True)
+        if after is not None:
+            view = view.filter(_after_key(view, sort_by, descending, after))
+        rows = view.head(limit)
+
+    next_cursor = None
+    if rows.height == limit and view.height > limit:
+        last = rows.row(rows.height - 1, named=True)
+        payload = {"version": version, "row": last["_row"]}
+        if sort_by is not None:
+            payload["value"] = last[sort_by]
+        next_cursor = encode_cursor(payload)
+
+    rows = rows.drop("_row")
+    return {"columns": rows.columns, "rows": rows.to_dicts(), "total": total, "next_cursor": next_cursor}
+
+
+def _after_key(view, sort_by: str, descending: bool, after: dict):
+    """Rows strictly after (value, row) in (sort_by, _row) order, nulls last."""
+    value, row = after.get("value"), after["row"]
+    col, row_col = pl.col(sort_by), pl.col("_row")
+    if value is None:
+        return col.is_null() & (row_col > row)
+    value = _as_value(view[sort_by], value)
+    beyond = col < value if descending else col > value
+    return beyond | ((col == value) & (row_col > row)) | col.is_null()
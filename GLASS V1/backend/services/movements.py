@@ -0,0 +1,81 @@
+from __future__ import annotations
+
+import os
+import threading
+
+from config import MOVEMENTS_DIR, MOVEMENTS_KEEP_VERSIONS
+from services import dimensions, snapshots, summaries
+from services.file_handler import dataset_key, use_streaming
+from services.lazy import lazy_import
+from services.transformations import attach_hierarchy, parse_posting_date
+
+pl = lazy_import("polars")
+
+_build_lock = threading.Lock()
+
+
+def _path(dataset: str) -> str:
+    return os.path.join(MOVEMENTS_DIR, f"{dataset}.parquet")
+
+
+def build() -> str:
+    """Write the movement pre-aggregate of the current dataset version, if missing."""
+    dataset = dataset_key()
+    if dataset is None:
+        return None
+    path = _path(dataset)
+    with _build_lock:
+        if os.path.exists(path):
+            return dataset
+
+        facts = dimensions.scan_facts() if use_streaming() else dimensions.load()[0]
+        facts = attach_hierarchy(parse_posting_date(facts))
+        df = summaries.build_movements(facts, dimensions.dimension_tables())
+
+        os.makedirs(MOVEMENTS_DIR, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        df.write_parquet(tmp_path)
+        os.replace(tmp_path, path)
+        _prune()
+    return dataset
+
+
+def _build_pinned() -> None:
+    try:
+        with snapshots.pinned():
+            build()
+    except Exception as e:
+        print(f"[WARN] Movement pre-aggregate failed: {e}")
+
+
+def build_in_background() -> None:
+    threading.Thread(target=_build_pinned, name="movements", daemon=True).start()
+
+
+def _stored() -> list:
+    if not os.path.isdir(MOVEMENTS_DIR):
+        return []
+    entries = [entry for entry in os.scandir(MOVEMENTS_DIR) if entry.name.endswith(".parquet")]
+    return sorted(entries, key=lambda entry: entry.stat().st_mtime_ns, reverse=True)
+
+
+def _prune() -> None:
+    for entry in _stored()[MOVEMENTS_KEEP_VERSIONS:]:
+        os.remove(entry.path)
+
+
+def scan(dataset: str) -> pl.LazyFrame:
+    """Movements of one dataset version; built on demand only for the live one."""
+    if not os.path.exists(_path(dataset)):
+        if dataset != dataset_key():
+            raise ValueError(
+                f"No movement pre-aggregate is kept for dataset version {dataset}; "
+                f"only the last {MOVEMENTS_KEEP_VERSIONS} published versions can be compared"
+            )
+        build()
+    return pl.scan_parquet(_path(dataset))
+
+
+def versions() -> list:
+    """Dataset versions that can be compared, newest first."""
+    return [entry.name[: -len(".parquet")] for entry in _stored()]
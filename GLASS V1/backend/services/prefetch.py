@@ -0,0 +1,181 @@
+from __future__ import annotations
+
+import queue
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from config import PREFETCH_ENABLED, PREFETCH_TOP_K, PREFETCH_MAX_PENDING
+from services import snapshots
+from services.file_handler import dataset_key
+
+# Results the prefetcher fills in, and whose later lookups count as hits or misses
+PREFETCHED_LEVELS = ("drilldown2", "drilldown3")
+
+_tasks = queue.Queue(maxsize=PREFETCH_MAX_PENDING)
+_pending = set()
+_prefetched = OrderedDict()   # cache keys computed speculatively and not yet requested
+_MAX_TRACKED = 4096
+_speculating = threading.local()
+_lock = threading.Lock()
+_worker = None
+
+# HTTP requests in flight in this process; speculative work only runs while it is 0
+_foreground = 0
+_idle = threading.Condition()
+
+_metrics = {
+    "scheduled": 0,       # tasks queued
+    "dropped": 0,         # tasks refused because the queue was full
+    "computed": 0,        # results computed speculatively
+    "already_cached": 0,  # tasks that found their result cached
+    "stale": 0,           # tasks skipped because a new dataset was uploaded
+    "failed": 0,
+    "deferred": 0,        # tasks that waited for client requests to finish
+    "hits": 0,            # Drilldown II/III requests answered by a prefetched result
+    "misses": 0,          # Drilldown II/III requests that had to be computed
+}
+
+
+def _bump(name: str, by: int = 1) -> None:
+    with _lock:
+        _metrics[name] += by
+
+
+def observe(name: str, key: str, hit: bool) -> None:
+    """Record a result-cache lookup made on behalf of a client request."""
+    if name not in PREFETCHED_LEVELS or getattr(_speculating, "active", False):
+        return
+    with _lock:
+        if hit and key in _prefetched:
+            del _prefetched[key]
+            _metrics["hits"] += 1
+        elif not hit:
+            _metrics["misses"] += 1
+
+
+def record_prefetched(key: str) -> None:
+    with _lock:
+        _prefetched[key] = None
+        while len(_prefetched) > _MAX_TRACKED:
+            _prefetched.popitem(last=False)
+
+
+def top_cells(rows: list, k: int = PREFETCH_TOP_K) -> list:
+    """The k Ageing x Division cells of a Drilldown I result with the largest amounts."""
+    ranked = sorted(rows, key=lambda r: abs(r["Total Amount"] or 0), reverse=True)
+    return [(r["Ageing"], r["Division"]) for r in ranked[:k]]
+
+
+def after_drilldown1(gl_account: str, current_date: str, result: dict) -> None:
+    """Queue the likely next clicks after a Drilldown I response."""
+    if not PREFETCH_ENABLED:
+        return
+    dataset = dataset_key()
+    if dataset is None:
+        return
+
+    cells = top_cells(result["rows"])
+    for ageing, division in cells:
+        _schedule(dataset, "drilldown2", (gl_account, ageing, division, current_date))
+    for ageing in dict.fromkeys(ageing for ageing, _ in cells):
+        _schedule(dataset, "drilldown3", (gl_account, ageing, current_date))
+
+
+def _schedule(dataset: str, level: str, args: tuple) -> None:
+    task = (dataset, level, args)
+    with _lock:
+        if task in _pending:
+            return
+        try:
+            _tasks.put_nowait(task)
+        except queue.Full:
+            _metrics["dropped"] += 1
+            return
+        _pending.add(task)
+        _metrics["scheduled"] += 1
+    _ensure_worker()
+
+
+def _ensure_worker() -> None:
+    global _worker
+    with _lock:
+        if _worker is None:
+            _worker = threading.Thread(target=_work, name="drilldown-prefetch", daemon=True)
+            _worker.start()
+
+
+# ========== Yielding to client requests ==========
+@contextmanager
+def foreground():
+    """Mark client work in flight; queued prefetches wait until none is left."""
+    global _foreground
+    with _idle:
+        _foreground += 1
+    try:
+        yield
+    finally:
+        with _idle:
+            _foreground -= 1
+            if _foreground == 0:
+                _idle.notify_all()
+
+
+class ForegroundMiddleware:
+    """Counts HTTP requests in flight so prefetching never competes with them.
+
+    The group-bys run on Polars' own thread pool, where thread priority has no
+    effect, so the prefetcher waits instead of running at a lower priority.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        with foreground():
+            await self.app(scope, receive, send)
+
+
+def _wait_until_idle() -> None:
+    with _idle:
+        if _foreground:
+            _bump("deferred")
+        _idle.wait_for(lambda: _foreground == 0)
+
+
+def _work() -> None:
+    from services import queries
+
+    _speculating.active = True
+    runners = {"drilldown2": queries.drilldown2, "drilldown3": queries.drilldown3}
+    while True:
+        task = _tasks.get()
+        dataset, level, args = task
+        _wait_until_idle()
+        try:
+            with snapshots.pinned():
+                if dataset_key() != dataset:
+                    _bump("stale")
+                    continue
+                computed = queries.speculate(level, runners[level], *args)
+            _bump("computed" if computed else "already_cached")
+        except Exception as e:
+            print(f"[WARN] Prefetch of {level}{args} failed: {e}")
+            _bump("failed")
+        finally:
+            with _lock:
+                _pending.discard(task)
+
+
+def stats() -> dict:
+    with _lock:
+        metrics = dict(_metrics)
+        metrics["pending"] = len(_pending)
+        metrics["unused"] = len(_prefetched)
+    requests = metrics["hits"] + metrics["misses"]
+    metrics["hit_rate"] = round(metrics["hits"] / requests, 3) if requests else None
+    metrics["enabled"] = PREFETCH_ENABLED
+    metrics["top_k"] = PREFETCH_TOP_K
+    return metrics
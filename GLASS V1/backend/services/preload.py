@@ -0,0 +1,71 @@
+import threading
+import time
+
+from services import dimensions, movements, queries, snapshots
+from services.file_handler import dataset_key, use_streaming
+
+_lock = threading.Lock()
+_status = {
+    "state": "pending",   # pending -> running -> ready | failed
+    "stage": None,
+    "progress": 0.0,
+    "error": None,
+    "started_at": None,
+    "finished_at": None,
+}
+
+
+def _update(**fields):
+    with _lock:
+        _status.update(fields)
+
+
+def status() -> dict:
+    with _lock:
+        return dict(_status)
+
+
+def is_ready() -> bool:
+    # A failed preload does not block traffic; requests load on demand instead.
+    return status()["state"] in ("ready", "failed")
+
+
+def _run():
+    _update(state="running", started_at=time.time())
+    try:
+        _update(stage="fingerprint", progress=0.1)
+        dataset = dataset_key()
+        if dataset is None:
+            _update(state="ready", stage="no dataset", progress=1.0, finished_at=time.time())
+            return
+
+        # Queries read the narrow fact file; the wide ledger is never kept resident.
+        # Datasets uploaded before dimensions existed get them built here.
+        _update(stage="load dimensions", progress=0.4)
+        if use_streaming():
+            dimensions.scan_facts()
+        else:
+            dimensions.load()
+
+        # Versions published before pre-aggregates existed become comparable from here on
+        _update(stage="pre-aggregate", progress=0.7)
+        movements.build()
+
+        _update(stage="warm cache", progress=0.8)
+        warmed = queries.result_cache.warm(dataset)
+        print(f"[INFO] Preloaded dataset {dataset}, warmed {warmed} cached results")
+
+        _update(state="ready", stage="done", progress=1.0, finished_at=time.time())
+    except Exception as e:
+        print(f"[WARN] Dataset preload failed: {e}")
+        _update(state="failed", error=str(e), finished_at=time.time())
+
+
+def _run_pinned():
+    with snapshots.pinned():
+        _run()
+
+
+def start() -> None:
+    """Preload the last uploaded dataset without holding up startup."""
+    threading.Thread(target=_run_pinned, name="dataset-preload", daemon=True).start()
@@ -0,0 +1,39 @@
+from __future__ import annotations
+
+import json
+
+from services import ai_summary
+
+# Keeps nginx and similar proxies from buffering the stream until it completes
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+def sse_event(event: str, data) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n".encode()
+
+
+def stream_tables(tables, summarize=None):
+    """Server-sent events for a result assembled table by table.
+
+    Emits one `table` event per (name, rows) pair as soon as it is computed,
+    then a `summary` event when `summarize(tables_so_far)` is given, and a
+    closing `done` event. A failure ends the stream with an `error` event.
+    """
+    sent = {}
+    try:
+        for name, rows in tables:
+            sent[name] = rows
+            yield sse_event("table", {"name": name, "rows": rows})
+
+        if summarize is not None:
+            if not ai_summary.is_available():
+                yield sse_event("summary", {"text": None, "error": "AI summary is not configured."})
+            else:
+                try:
+                    yield sse_event("summary", summarize(sent))
+                except Exception as e:
+                    yield sse_event("summary", {"text": None, "error": f"Could not generate AI summary. Error: {e}"})
+
+        yield sse_event("done", {"tables": list(sent)})
+    except Exception as e:
+        yield sse_event("error", {"error": str(e)})
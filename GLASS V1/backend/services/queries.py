@@ -0,0 +1,292 @@
+from __future__ import annotations
+
+import threading
+from datetime import datetime
+
+from config import CACHE_DIR, CACHE_MAX_BYTES, CACHE_MAX_ENTRIES, CACHE_MEMORY_ENTRIES
+from services import ai_prompt, ai_summary, dimensions, hierarchy, movements, prefetch, summaries
+from services.cache import ResultCache
+from services.file_handler import dataset_key, use_streaming
+from services.filters import gl_filter, drill_filter
+from services.lazy import lazy_import
+from services.singleflight import SingleFlight
+from services.transformations import add_ageing, as_of, derive_columns
+
+pl = lazy_import("polars")
+
+result_cache = ResultCache(CACHE_DIR, CACHE_MAX_BYTES, CACHE_MAX_ENTRIES, CACHE_MEMORY_ENTRIES)
+
+# Identical cache misses in flight at the same time are computed once. Cache keys
+# already cover the normalized parameters and the dataset version.
+flights = SingleFlight()
+
+# (key, hit) of this thread's last result lookup
+_last_lookup = threading.local()
+
+
+def resolve_date(current_date):
+    if current_date is None:
+        current_date = datetime.now().strftime("%Y-%m-%d")
+    return current_date
+
+
+def cached_result(name: str, params: dict, compute):
+    dataset = dataset_key()
+    if dataset is None:
+        return compute()
+
+    key = result_cache.make_key(f"result:{name}", params, dataset)
+    value = result_cache.get_result(key)
+    hit = value is not None
+    prefetch.observe(name, key, hit)
+    _last_lookup.value = (key, hit)
+    if not hit:
+        def compute_and_store():
+            value = compute()
+            result_cache.put_result(key, dataset, value)
+            return value
+
+        value = flights.do(key, compute_and_store)
+    return value
+
+
+def speculate(name: str, query, *args) -> bool:
+    """Run a query only to fill the cache; True if it had to be computed."""
+    _last_lookup.value = None
+    query(*args)
+    if _last_lookup.value is None:
+        return False
+    key, hit = _last_lookup.value
+    if not hit:
+        prefetch.record_prefetched(key)
+    return not hit
+
+
+def cached_frame(kind: str, params: dict, compute, dataset: str = None) -> pl.DataFrame:
+    dataset = dataset or dataset_key()
+    if dataset is None:
+        return compute()
+
+    key = result_cache.make_key(kind, params, dataset)
+    df = result_cache.get_frame(key)
+    if df is None:
+        def compute_and_store():
+            df = compute()
+            result_cache.put_frame(key, dataset, df)
+            return df
+
+        df = flights.do(key, compute_and_store)
+    return df
+
+
+# ========== Derived datasets and cubes ==========
+def derived_scan(gl_account: str, current_date: str) -> pl.LazyFrame:
+    """Out-of-core counterpart of derived_frame, for ledgers larger than RAM."""
+    return derive_columns(dimensions.scan_facts().filter(gl_filter(gl_account)), current_date)
+
+
+def derived_frame(gl_account: str, current_date: str) -> pl.DataFrame:
+    """Fact rows of one G/L account with Ageing and Division attached.
+
+    Built from the narrow fact file, so counterparties are integer keys; see
+    dimensions.py for the tables that resolve them.
+    """
+    def compute():
+        facts, _ = dimensions.load()
+        df = facts.filter(gl_filter(gl_account))
+        return derive_columns(df, current_date)
+
+    return cached_frame("derived", {"gl_account": gl_account, "current_date": current_date}, compute)
+
+
+def cube(gl_account: str, current_date: str) -> pl.DataFrame:
+    def compute():
+        if use_streaming():
+            return summaries.build_cube(derived_scan(gl_account, current_date)).collect(engine="streaming")
+        return summaries.build_cube(derived_frame(gl_account, current_date))
+
+    return cached_frame("cube", {"gl_account": gl_account, "current_date": current_date}, compute)
+
+
+def movement_cube(gl_account: str, current_date: str, dataset: str) -> pl.DataFrame:
+    """Cube at vendor grain of any kept dataset version, bucketed for `current_date`.
+
+    Re-buckets that version's stored movements, so any reference date works
+    without going back to its ledger. Postings after `current_date` are left
+    out: they had not happened yet at that date.
+    """
+    def compute():
+        df = as_of(movements.scan(dataset).filter(gl_filter(gl_account)), current_date)
+        return summaries.build_movement_cube(add_ageing(df, current_date))
+
+    return cached_frame("movement-cube", {"gl_account": gl_account, "current_date": current_date}, compute, dataset)
+
+
+# ========== Query results ==========
+def filtered_summary(gl_account: str, current_date: str) -> dict:
+    def compute():
+        c = cube(gl_account, current_date)
+        return {
+            "ageing_table": summaries.ageing_table(c).to_dicts(),
+            "division_table": summaries.division_table(c).to_dicts()
+        }
+
+    return cached_result("filtered-summary", {"gl_account": gl_account, "current_date": current_date}, compute)
+
+
+def filtered_summary_tables(gl_account: str, current_date: str):
+    """The filtered summary one table at a time, as (name, rows) pairs."""
+    params = {"gl_account": gl_account, "current_date": current_date}
+    builders = [("ageing_table", summaries.ageing_table), ("division_table", summaries.division_table)]
+    for name, build in builders:
+        rows = cached_result(f"filtered-summary:{name}", params, lambda build=build: build(cube(gl_account, current_date)).to_dicts())
+        yield name, rows
+
+
+def drilldown1(gl_account: str, current_date: str) -> dict:
+    def compute():
+        grouped = summaries.ageing_division_table(cube(gl_account, current_date))
+        return {"columns": grouped.columns, "rows": grouped.to_dicts()}
+
+    return cached_result("drilldown1", {"gl_account": gl_account, "current_date": current_date}, compute)
+
+
+def drilldown2(gl_account: str, ageing: str, division: str, current_date: str) -> dict:
+    def compute():
+        grouped = summaries.business_area_table(cube(gl_account, current_date), ageing, division)
+        return {"columns": grouped.columns, "rows": grouped.to_dicts()}
+
+    params = {"gl_account": gl_account, "ageing": ageing, "division": division, "current_date": current_date}
+    return cached_result("drilldown2", params, compute)
+
+
+def drilldown3(gl_account: str, ageing: str, current_date: str) -> dict:
+    def compute():
+        grouped = summaries.division_business_area_table(cube(gl_account, current_date), ageing)
+        return {"columns": grouped.columns, "rows": grouped.to_dicts()}
+
+    params = {"gl_account": gl_account, "ageing": ageing, "current_date": current_date}
+    return cached_result("drilldown3", params, compute)
+
+
+def drilldown4(gl_account: str, ageing: str, division: str, business_area: str, current_date: str) -> dict:
+    def compute():
+        if use_streaming():
+            df = derived_scan(gl_account, current_date)
+        else:
+            df = derived_frame(gl_account, current_date)
+        df = df.filter(drill_filter(ageing, division, business_area))
+        return summaries.counterparty_tables(df, dimensions.dimension_tables())
+
+    params = {
+        "gl_account": gl_account, "ageing": ageing, "division": division,
+        "business_area": business_area, "current_date": current_date,
+    }
+    return cached_result("drilldown4", params, compute)
+
+
+def hierarchy_rollups(gl_account: str, current_date: str) -> dict:
+    """Totals at every hierarchy level (Region > Segment > Division > Business Area)."""
+    def compute():
+        return hierarchy.rollups(cube(gl_account, current_date))
+
+    return cached_result("hierarchy-rollups", {"gl_account": gl_account, "current_date": current_date}, compute)
+
+
+def variance_points(base_date: str = None, compare_date: str = None, base_version: str = None, compare_version: str = None):
+    """(base, compare) as {"version", "date"}; omitted parts default to the live dataset and today."""
+    compare = {"version": compare_version or dataset_key(), "date": resolve_date(compare_date)}
+    base = {"version": base_version or compare["version"], "date": base_date or compare["date"]}
+    for point in (base, compare):
+        datetime.strptime(point["date"], "%Y-%m-%d")
+    if base == compare:
+        raise ValueError("Give a base_date or a base_version to compare against")
+    return base, compare
+
+
+def variance_tables(gl_account: str, base: dict, compare: dict, top: int):
+    """Deltas between two (dataset version, reference date) points, as (name, rows) pairs.
+
+    Each side is re-bucketed from its version's stored movements, so a
+    comparison never goes back to either ledger.
+    """
+    params = {"gl_account": gl_account, "base": base, "compare": compare, "top": top}
+    cubes = {}
+
+    def sides():
+        if not cubes:
+            cubes["base"] = movement_cube(gl_account, base["date"], base["version"])
+            cubes["compare"] = movement_cube(gl_account, compare["date"], compare["version"])
+        return cubes["base"], cubes["compare"]
+
+    def totals():
+        base_cube, compare_cube = sides()
+        base_total = base_cube["Total Amount"].sum()
+        compare_total = compare_cube["Total Amount"].sum()
+        return [{"Base Amount": base_total, "Compare Amount": compare_total, "Change": round(compare_total - base_total, 6) + 0.0}]
+
+    yield "totals", cached_result("variance:totals", params, totals)
+    for view in summaries.VARIANCE_VIEWS:
+        limit = None if view == "ageing_division" else top
+        rows = cached_result(f"variance:{view}", params, lambda view=view, limit=limit: summaries.variance_table(*sides(), view, limit).to_dicts())
+        yield view, rows
+
+
+def variance(gl_account: str, base: dict, compare: dict, top: int) -> dict:
+    result = {"base": base, "compare": compare}
+    result.update(variance_tables(gl_account, base, compare, top))
+    return result
+
+
+def drilldown4_tables(gl_account: str, ageing: str, division: str, business_area: str, current_date: str):
+    """Drilldown IV one grouping at a time, smallest first, as (name, rows) pairs.
+
+    In streaming mode each grouping is its own scan, so the first table arrives
+    after one pass over the ledger instead of waiting for all three.
+    """
+    def selection():
+        if use_streaming():
+            df = derived_scan(gl_account, current_date)
+        else:
+            df = derived_frame(gl_account, current_date)
+        return df.filter(drill_filter(ageing, division, business_area))
+
+    params = {
+        "gl_account": gl_account, "ageing": ageing, "division": division,
+        "business_area": business_area, "current_date": current_date,
+    }
+    for name in summaries.COUNTERPARTY_GROUPINGS:
+        rows = cached_result(
+            f"drilldown4:{name}", params,
+            lambda name=name: summaries.counterparty_table(selection(), dimensions.dimension_tables(), name),
+        )
+        yield name, rows
+
+
+# ========== AI summaries ==========
+def filtered_summary_ai(gl_account: str, current_date: str, tables: dict) -> dict:
+    def compute():
+        prompt = ai_prompt.summary_prompt(gl_account, tables["ageing_table"], tables["division_table"])
+        return {"text": ai_summary.generate(prompt)}
+
+    return cached_result("ai-summary:filtered-summary", {"gl_account": gl_account, "current_date": current_date}, compute)
+
+
+def variance_ai(gl_account: str, base: dict, compare: dict, top: int, tables: dict) -> dict:
+    def compute():
+        prompt = ai_prompt.variance_prompt(gl_account, base, compare, **tables)
+        return {"text": ai_summary.generate(prompt)}
+
+    return cached_result("ai-summary:variance", {"gl_account": gl_account, "base": base, "compare": compare, "top": top}, compute)
+
+
+def drilldown4_ai(gl_account: str, ageing: str, division: str, business_area: str, current_date: str, tables: dict) -> dict:
+    def compute():
+        prompt = ai_prompt.drilldown_prompt(gl_account, ageing, division, business_area, **tables)
+        return {"text": ai_summary.generate(prompt)}
+
+    params = {
+        "gl_account": gl_account, "ageing": ageing, "division": division,
+        "business_area": business_area, "current_date": current_date,
+    }
+    return cached_result("ai-summary:drilldown4", params, compute)
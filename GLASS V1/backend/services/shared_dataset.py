@@ -0,0 +1,170 @@
+from __future__ import annotations
+
+import fcntl
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from config import PARQUET_FILE, SHARED_DIR
+from services import snapshots
+from services.file_handler import file_digest, read_ipc_mmap, seed_digest
+from services.lazy import lazy_import
+from services.snapshots import resolve
+
+pl = lazy_import("polars")
+
+MANIFEST_FILE = os.path.join(SHARED_DIR, "manifest.json")
+LOCK_FILE = os.path.join(SHARED_DIR, ".publish.lock")
+
+# What this worker currently has mapped
+_attached = {"version": None, "df": None}
+_attached_lock = threading.Lock()
+
+
+def _parquet_stamp():
+    st = os.stat(resolve(PARQUET_FILE))
+    return [st.st_size, st.st_mtime_ns]
+
+
+def _read_json(path: str):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _write_json(path: str, value: dict) -> None:
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(value, f)
+    os.replace(tmp_path, path)
+
+
+def read_manifest():
+    """Entry of the newest snapshot published here."""
+    return _read_json(MANIFEST_FILE)
+
+
+def _entry_file(snapshot: str) -> str:
+    return os.path.join(SHARED_DIR, f"snapshot-{snapshot}.json")
+
+
+def _read_entry(snapshot: str):
+    """What publish() recorded for a snapshot, or None if its ledger file is missing."""
+    entry = _read_json(_entry_file(snapshot))
+    if entry is None or not os.path.exists(os.path.join(SHARED_DIR, entry["file"])):
+        return None
+    return entry
+
+
+def _entries() -> list:
+    if not os.path.isdir(SHARED_DIR):
+        return []
+    names = [name for name in os.listdir(SHARED_DIR) if name.startswith("snapshot-") and name.endswith(".json")]
+    return [(name, entry) for name in names if (entry := _read_json(os.path.join(SHARED_DIR, name))) is not None]
+
+
+@contextmanager
+def _publish_lock():
+    os.makedirs(SHARED_DIR, exist_ok=True)
+    with open(LOCK_FILE, "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def publish(df: pl.DataFrame = None) -> dict:
+    """Write the ledger of this reader's snapshot as an immutable Arrow file.
+
+    Ledger files are named by content, so snapshots that share a Parquet file
+    (a mapping-only upload) share one. Only one process publishes at a time;
+    the others block on the lock and then find the entry already there.
+    """
+    snapshot = snapshots.reading()
+    with _publish_lock():
+        entry = _read_entry(snapshot)
+        if entry is None:
+            parquet_file = resolve(PARQUET_FILE)
+            stamp = _parquet_stamp()
+            # Carried-over Parquet files keep their stamp, so their digest is known already
+            published = [e for _, e in _entries()] + [read_manifest()]
+            known = [e["source_digest"] for e in published if e and e["source_stamp"] == stamp]
+            digest = known[0] if known else file_digest(parquet_file)
+            file_name = f"ledger-{digest[:16]}.arrow"
+            path = os.path.join(SHARED_DIR, file_name)
+            if not os.path.exists(path):
+                if df is None:
+                    df = pl.read_parquet(parquet_file)
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                df.write_ipc(tmp_path, compression="uncompressed")
+                os.replace(tmp_path, path)
+            entry = {
+                "snapshot": snapshot,
+                "version": digest[:16],
+                "file": file_name,
+                "source_digest": digest,
+                "source_stamp": stamp,
+                "published_at": time.time(),
+            }
+            _write_json(_entry_file(snapshot), entry)
+
+        # Readers still pinned to an older snapshot never move the manifest back
+        manifest = read_manifest()
+        if snapshot == snapshots.current() and (manifest is None or manifest.get("snapshot") != snapshot):
+            _write_json(MANIFEST_FILE, entry)
+        return entry
+
+
+def _sweep(removed: list = None) -> None:
+    """Drop entries of collected snapshots, then ledger files no entry uses.
+
+    The manifest's ledger is kept too: a mapping-only upload's snapshot reuses
+    it, but has no entry of its own until a reader first attaches. Workers
+    still mapping a removed file keep its pages until they re-attach.
+    """
+    if not os.path.isdir(SHARED_DIR):
+        return
+    with _publish_lock():
+        manifest = read_manifest()
+        in_use = {manifest["file"]} if manifest else set()
+        for name, entry in _entries():
+            if snapshots.is_stored(entry["snapshot"]):
+                in_use.add(entry["file"])
+            else:
+                os.remove(os.path.join(SHARED_DIR, name))
+        for name in os.listdir(SHARED_DIR):
+            if name.startswith("ledger-") and name.endswith(".arrow") and name not in in_use:
+                os.remove(os.path.join(SHARED_DIR, name))
+
+
+snapshots.on_collect(_sweep)
+
+
+def attach() -> pl.DataFrame:
+    """Read-only view of this reader's ledger, re-mapped when the version changes."""
+    entry = _read_entry(snapshots.reading())
+    if entry is None:
+        entry = publish()
+
+    # The entry already knows the content hash, so workers never re-hash the Parquet file
+    seed_digest(resolve(PARQUET_FILE), tuple(entry["source_stamp"]), entry["source_digest"])
+
+    with _attached_lock:
+        if _attached["version"] != entry["version"]:
+            try:
+                _attached["df"] = read_ipc_mmap(os.path.join(SHARED_DIR, entry["file"]))
+            except FileNotFoundError:
+                # Unpinned, and the snapshot was collected after reading its entry
+                entry = publish()
+                _attached["df"] = read_ipc_mmap(os.path.join(SHARED_DIR, entry["file"]))
+            _attached["version"] = entry["version"]
+        return _attached["df"]
+
+
+def attached_version():
+    return _attached["version"]
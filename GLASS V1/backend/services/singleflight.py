@@ -0,0 +1,58 @@
+from __future__ import annotations
+
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SingleFlight:
+    """Runs at most one computation per key at a time within this process.
+
+    Callers that arrive while a computation for their key is in flight wait
+    for it and share its result (or its exception) instead of repeating it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._metrics = {"calls": 0, "executions": 0, "coalesced": 0}
+
+    def do(self, key: str, compute):
+        with self._lock:
+            self._metrics["calls"] += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self._metrics["executions"] += 1
+            else:
+                self._metrics["coalesced"] += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value
+
+        try:
+            call.value = compute()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.value
+
+    def stats(self) -> dict:
+        with self._lock:
+            metrics = dict(self._metrics)
+            metrics["in_flight"] = len(self._calls)
+        metrics["coalescing_ratio"] = round(metrics["coalesced"] / metrics["calls"], 3) if metrics["calls"] else None
+        return metrics
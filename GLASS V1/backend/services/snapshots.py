@@ -0,0 +1,328 @@
+from __future__ import annotations
+
+import contextvars
+import fcntl
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import anyio
+import anyio.to_thread
+
+from config import (
+    UPLOAD_DIR, SNAPSHOTS_DIR, PARQUET_FILE, MAPPING_FILE, IPC_FILE, LINE_ITEM_INDEX_FILE,
+    COUNTERPARTY_FACTS_FILE, COUNTERPARTY_FACTS_PARQUET_FILE, DIMENSION_FILES,
+)
+
+MANIFEST_FILE = os.path.join(SNAPSHOTS_DIR, "manifest.json")
+PUBLISH_LOCK_FILE = os.path.join(SNAPSHOTS_DIR, ".publish.lock")
+
+# Everything derived from one upload; a mapping change carries these over unchanged
+DATA_FILES = [
+    PARQUET_FILE, IPC_FILE, LINE_ITEM_INDEX_FILE, COUNTERPARTY_FACTS_FILE, COUNTERPARTY_FACTS_PARQUET_FILE,
+    *DIMENSION_FILES.values(),
+]
+SNAPSHOT_FILES = DATA_FILES + [MAPPING_FILE]
+
+# Snapshot the current request (or background task) reads from
+_pinned = contextvars.ContextVar("snapshot", default=None)
+
+# snapshot id -> [lock file descriptor, pins in this process]
+_holds = {}
+_holds_lock = threading.Lock()
+_migrate_lock = threading.Lock()
+
+# Called with the ids garbage collection removed; see on_collect()
+_collect_callbacks = []
+
+
+def _snapshot_dir(snapshot: str) -> str:
+    return os.path.join(SNAPSHOTS_DIR, snapshot)
+
+
+def _reader_lock_file(snapshot: str) -> str:
+    return os.path.join(SNAPSHOTS_DIR, f"{snapshot}.lock")
+
+
+def read_manifest():
+    try:
+        with open(MANIFEST_FILE) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def current():
+    """Id of the published snapshot, or None before the first upload."""
+    manifest = read_manifest()
+    if manifest is None:
+        manifest = _migrate_legacy_files()
+    return manifest["snapshot"] if manifest else None
+
+
+def reading():
+    """Snapshot this reader sees: its pinned one, else the published one."""
+    return _pinned.get() or current()
+
+
+def is_stored(snapshot: str) -> bool:
+    """False once garbage collection has removed the snapshot."""
+    return os.path.isdir(_snapshot_dir(snapshot))
+
+
+def resolve(live_path: str) -> str:
+    """Where a dataset file (PARQUET_FILE, MAPPING_FILE, ...) lives for this reader."""
+    snapshot = reading()
+    if snapshot is None:
+        return live_path
+    return os.path.join(_snapshot_dir(snapshot), os.path.basename(live_path))
+
+
+# ========== Readers ==========
+def _hold(snapshot: str) -> bool:
+    """Take a shared lock on a snapshot so garbage collection leaves it alone."""
+    with _holds_lock:
+        if snapshot in _holds:
+            _holds[snapshot][1] += 1
+            return True
+        try:
+            fd = os.open(_reader_lock_file(snapshot), os.O_RDWR)
+        except FileNotFoundError:
+            return False  # collected between reading the manifest and getting here
+        fcntl.flock(fd, fcntl.LOCK_SH)
+        if not os.path.isdir(_snapshot_dir(snapshot)):
+            os.close(fd)
+            return False
+        _holds[snapshot] = [fd, 1]
+        return True
+
+
+def _release(snapshot: str) -> None:
+    with _holds_lock:
+        hold = _holds[snapshot]
+        hold[1] -= 1
+        if hold[1] > 0:
+            return
+        del _holds[snapshot]
+        os.close(hold[0])  # drops the shared lock
+    if snapshot != current():
+        collect_garbage(wait=False)
+
+
+def _acquire():
+    """Hold the current snapshot, retrying if it is collected under us. Blocking."""
+    snapshot = current()
+    while snapshot is not None and not _hold(snapshot):
+        snapshot = current()
+    return snapshot
+
+
+@contextmanager
+def pinned():
+    """Read one snapshot for the whole block, whatever is published meanwhile.
+
+    Re-entrant: nested blocks keep the outer pin. Never waits on an ingest.
+    """
+    if _pinned.get() is not None:
+        yield _pinned.get()
+        return
+
+    snapshot = _acquire()
+    token = _pinned.set(snapshot)
+    try:
+        yield snapshot
+    finally:
+        _pinned.reset(token)
+        if snapshot is not None:
+            _release(snapshot)
+
+
+class PinSnapshotMiddleware:
+    """Pins every HTTP request to one snapshot until its response body is sent.
+
+    Locking and garbage collection touch the disk, so they run in the threadpool
+    rather than on the event loop.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or _pinned.get() is not None:
+            return await self.app(scope, receive, send)
+
+        with anyio.CancelScope(shield=True):
+            snapshot = await anyio.to_thread.run_sync(_acquire)
+        token = _pinned.set(snapshot)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _pinned.reset(token)
+            if snapshot is not None:
+                # Shielded so a client disconnect cannot leak the hold
+                with anyio.CancelScope(shield=True):
+                    await anyio.to_thread.run_sync(_release, snapshot)
+
+
+# ========== Writers ==========
+@contextmanager
+def _publish_lock(blocking: bool = True):
+    os.makedirs(SNAPSHOTS_DIR, exist_ok=True)
+    with open(PUBLISH_LOCK_FILE, "w") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def new_staging_dir() -> str:
+    """Empty directory to assemble a snapshot in; same filesystem, so publishing is a rename."""
+    path = os.path.join(SNAPSHOTS_DIR, f".staging-{uuid.uuid4().hex}")
+    os.makedirs(path)
+    return path
+
+
+def _link_or_copy(source: str, target: str) -> None:
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+
+
+def _publish_locked(staging_dir: str, carry: list) -> dict:
+    previous = read_manifest()
+    if previous is not None:
+        # Copy-on-write: unchanged files are hard links to the previous snapshot's
+        for live_path in carry:
+            source = os.path.join(_snapshot_dir(previous["snapshot"]), os.path.basename(live_path))
+            target = os.path.join(staging_dir, os.path.basename(live_path))
+            if os.path.exists(source) and not os.path.exists(target):
+                _link_or_copy(source, target)
+
+    snapshot = f"{time.time_ns()}-{uuid.uuid4().hex[:8]}"
+    open(_reader_lock_file(snapshot), "w").close()
+    os.rename(staging_dir, _snapshot_dir(snapshot))
+
+    manifest = {
+        "snapshot": snapshot,
+        "parent": previous["snapshot"] if previous else None,
+        "files": sorted(os.listdir(_snapshot_dir(snapshot))),
+        "published_at": time.time(),
+    }
+    tmp_manifest = f"{MANIFEST_FILE}.{os.getpid()}.tmp"
+    with open(tmp_manifest, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_manifest, MANIFEST_FILE)
+    return manifest
+
+
+def publish(staging_dir: str, carry: list) -> dict:
+    """Make a fully written staging directory the current snapshot.
+
+    Files in `carry` that the staging directory lacks are taken over from the
+    snapshot being replaced. Readers switch over with the manifest rename and
+    never see a partially written dataset or a data/mapping mix.
+    """
+    with _publish_lock():
+        manifest = _publish_locked(staging_dir, carry)
+        removed = _collect_locked(manifest["snapshot"])
+    _collected(removed)
+    return manifest
+
+
+def _migrate_legacy_files():
+    """Move files from the flat pre-snapshot layout into a first snapshot."""
+    with _migrate_lock, _publish_lock():
+        manifest = read_manifest()
+        if manifest is not None:
+            return manifest
+        legacy = [path for path in SNAPSHOT_FILES if os.path.exists(path)]
+        if not os.path.exists(PARQUET_FILE) and not os.path.exists(MAPPING_FILE):
+            return None
+        staging_dir = new_staging_dir()
+        for path in legacy:
+            os.replace(path, os.path.join(staging_dir, os.path.basename(path)))
+        print(f"[INFO] Moved {len(legacy)} files from {UPLOAD_DIR} into a snapshot")
+        return _publish_locked(staging_dir, [])
+
+
+# ========== Garbage collection ==========
+def _collect_locked(keep: str) -> list:
+    removed = []
+    for name in os.listdir(SNAPSHOTS_DIR):
+        path = os.path.join(SNAPSHOTS_DIR, name)
+        if name == keep or not os.path.isdir(path):
+            continue
+        if name.startswith(".staging-"):
+            # Left behind by a crashed ingest; a live one has written a file within the hour
+            touched = max([os.stat(path).st_mtime] + [e.stat().st_mtime for e in os.scandir(path)])
+            if time.time() - touched > 3600:
+                shutil.rmtree(path, ignore_errors=True)
+            continue
+
+        lock_path = _reader_lock_file(name)
+        try:
+            fd = os.open(lock_path, os.O_RDWR | os.O_CREAT)
+        except OSError:
+            continue
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            continue  # some reader still holds it
+        try:
+            shutil.rmtree(path, ignore_errors=True)
+            os.remove(lock_path)
+            removed.append(name)
+        finally:
+            os.close(fd)
+    return removed
+
+
+def on_collect(callback) -> None:
+    """Call `callback(removed)` whenever garbage collection removes snapshots.
+
+    For files kept elsewhere per snapshot; runs after the publish lock is released.
+    """
+    _collect_callbacks.append(callback)
+
+
+def _collected(removed: list) -> None:
+    if removed:
+        for callback in _collect_callbacks:
+            callback(removed)
+
+
+def collect_garbage(wait: bool = True) -> list:
+    """Delete snapshots that are neither current nor held by any reader in any process."""
+    with _publish_lock(blocking=wait) as locked:
+        if not locked:
+            return []
+        manifest = read_manifest()
+        if manifest is None:
+            return []
+        removed = _collect_locked(manifest["snapshot"])
+    _collected(removed)
+    return removed
+
+
+def stats() -> dict:
+    manifest = read_manifest()
+    stored = []
+    if os.path.isdir(SNAPSHOTS_DIR):
+        stored = sorted(
+            name for name in os.listdir(SNAPSHOTS_DIR)
+            if os.path.isdir(os.path.join(SNAPSHOTS_DIR, name)) and not name.startswith(".")
+        )
+    with _holds_lock:
+        held = {snapshot: hold[1] for snapshot, hold in _holds.items()}
+    return {"current": manifest, "stored": stored, "held_by_this_process": held}
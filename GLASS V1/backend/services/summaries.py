@@ -0,0 +1,158 @@
+from __future__ import annotations
+
+from config import HIERARCHY_LEVELS
+from services.lazy import lazy_import
+
+pl = lazy_import("polars")
+
+AMOUNT_COL = "Amount in Local Currency"
+
+# Grain of the per-G/L cube. Every view up to Drilldown III, and every level of the
+# hierarchy roll-ups, is a roll-up of it. Segment and Region join in when mapped.
+CUBE_DIMENSIONS = ["Ageing", *HIERARCHY_LEVELS, "Business Area"]
+
+
+def total_amount(col: str = AMOUNT_COL):
+    return pl.col(col).sum().alias("Total Amount")
+
+
+def build_cube(df: pl.DataFrame | pl.LazyFrame) -> pl.DataFrame | pl.LazyFrame:
+    present = df.collect_schema().names()
+    return df.group_by([c for c in CUBE_DIMENSIONS if c in present]).agg(total_amount())
+
+
+def roll_up(cube: pl.DataFrame, by) -> pl.DataFrame:
+    return cube.group_by(by).agg(total_amount("Total Amount"))
+
+
+# ========== Filtered Summary ==========
+def ageing_table(cube: pl.DataFrame) -> pl.DataFrame:
+    return roll_up(cube, "Ageing").sort("Ageing")
+
+
+def division_table(cube: pl.DataFrame) -> pl.DataFrame:
+    return roll_up(cube, "Division").sort("Division")
+
+
+# ========== Drilldown I - III ==========
+def ageing_division_table(cube: pl.DataFrame) -> pl.DataFrame:
+    return roll_up(cube, ["Ageing", "Division"]).sort(["Ageing", "Division"])
+
+
+def business_area_table(cube: pl.DataFrame, ageing: str, division: str) -> pl.DataFrame:
+    cube = cube.filter((pl.col("Ageing") == ageing) & (pl.col("Division") == division))
+    return roll_up(cube, "Business Area").sort("Total Amount", descending=True)
+
+
+def division_business_area_table(cube: pl.DataFrame, ageing: str) -> pl.DataFrame:
+    cube = cube.filter(pl.col("Ageing") == ageing)
+    return roll_up(cube, ["Division", "Business Area"]).sort(["Division", "Business Area"])
+
+
+# ========== Drilldown IV ==========
+# Smallest first: progressive responses send the cheapest grouping before the rest
+COUNTERPARTY_GROUPINGS = {
+    "document_types": ["Document Type"],
+    "vendors": ["Vendor Code", "Vendor Name"],
+    "customers": ["Customer Code", "Customer Name"],
+}
+
+# Integer surrogate keys the fact rows carry instead of the text columns above
+COUNTERPARTY_KEYS = {
+    "document_types": "Document Type Key",
+    "vendors": "Vendor Key",
+    "customers": "Customer Key",
+}
+
+
+def counterparty_grouping(facts: pl.DataFrame | pl.LazyFrame, dimensions: dict, name: str) -> pl.DataFrame | pl.LazyFrame:
+    """Group on the integer key, then attach codes and names from the (small) dimension table."""
+    key = COUNTERPARTY_KEYS[name]
+    dimension = dimensions[name]
+    if isinstance(facts, pl.LazyFrame):
+        dimension = dimension.lazy()
+    return (
+        facts.group_by(key).agg(total_amount())
+        .join(dimension, on=key, how="left")
+        .select(COUNTERPARTY_GROUPINGS[name] + ["Total Amount"])
+        .sort("Total Amount", descending=True)
+    )
+
+
+def counterparty_table(facts: pl.DataFrame | pl.LazyFrame, dimensions: dict, name: str) -> list:
+    """One Drilldown IV grouping on its own, for progressive delivery."""
+    grouped = counterparty_grouping(facts, dimensions, name)
+    if isinstance(grouped, pl.LazyFrame):
+        grouped = grouped.collect(engine="streaming")
+    return grouped.to_dicts()
+
+
+def counterparty_tables(facts: pl.DataFrame | pl.LazyFrame, dimensions: dict) -> dict:
+    names = ["vendors", "customers", "document_types"]
+    grouped = [counterparty_grouping(facts, dimensions, name) for name in names]
+
+    if isinstance(facts, pl.LazyFrame):
+        grouped = pl.collect_all(grouped, engine="streaming")
+
+    return {name: table.to_dicts() for name, table in zip(names, grouped)}
+
+
+# ========== Variance ==========
+# Grain of the stored movement pre-aggregate: the movement cube without Ageing, so
+# one copy per dataset version can be re-bucketed for any reference date
+MOVEMENT_DIMENSIONS = ["G/L Account", "Posting Date", *HIERARCHY_LEVELS, "Business Area"]
+
+# Compared views: (keys the two sides are joined on, labels carried along)
+VARIANCE_VIEWS = {
+    "ageing_division": (["Ageing", "Division"], []),
+    "business_areas": (["Business Area"], []),
+    "vendors": (["Vendor Code"], ["Vendor Name"]),
+}
+
+
+def build_movements(facts: pl.DataFrame | pl.LazyFrame, dimensions: dict) -> pl.DataFrame:
+    """Date-independent pre-aggregate of every G/L at MOVEMENT_DIMENSIONS grain.
+
+    Keyed by vendor code so it compares across uploads: surrogate keys are
+    assigned per ingest, so they are resolved before it is stored.
+    """
+    present = facts.collect_schema().names()
+    key = COUNTERPARTY_KEYS["vendors"]
+    vendors = dimensions["vendors"]
+    grouped = facts.group_by([c for c in MOVEMENT_DIMENSIONS if c in present] + [key]).agg(total_amount())
+    grouped = grouped.join(vendors.lazy() if isinstance(grouped, pl.LazyFrame) else vendors, on=key, how="left").drop(key)
+    if isinstance(grouped, pl.LazyFrame):
+        grouped = grouped.collect(engine="streaming")
+    return grouped
+
+
+def build_movement_cube(movements: pl.DataFrame | pl.LazyFrame) -> pl.DataFrame:
+    """The cube at vendor grain, from movements of one G/L with Ageing attached."""
+    present = movements.collect_schema().names()
+    keys = [c for c in CUBE_DIMENSIONS if c in present] + COUNTERPARTY_GROUPINGS["vendors"]
+    grouped = movements.group_by(keys).agg(total_amount("Total Amount"))
+    if isinstance(grouped, pl.LazyFrame):
+        grouped = grouped.collect(engine="streaming")
+    return grouped
+
+
+def variance_table(base: pl.DataFrame, compare: pl.DataFrame, view: str, top: int = None) -> pl.DataFrame:
+    """Keyed full join of two roll-ups, largest absolute change first."""
+    keys, labels = VARIANCE_VIEWS[view]
+
+    def side(cube, name):
+        return cube.group_by(keys).agg(
+            [total_amount("Total Amount").alias(name)] + [pl.col(label).first().alias(f"{label}|{name}") for label in labels]
+        )
+
+    joined = side(base, "Base Amount").join(side(compare, "Compare Amount"), on=keys, how="full", coalesce=True)
+    joined = joined.with_columns(
+        [pl.coalesce([f"{label}|Compare Amount", f"{label}|Base Amount"]).alias(label) for label in labels]
+        + [pl.col("Base Amount").fill_null(0), pl.col("Compare Amount").fill_null(0)]
+    )
+    # Rounded so float noise from summing in a different order does not rank as a change
+    change = (pl.col("Compare Amount") - pl.col("Base Amount")).round(6)
+    joined = joined.with_columns(pl.when(change == 0).then(0.0).otherwise(change).alias("Change"))
+    joined = joined.select(keys + labels + ["Base Amount", "Compare Amount", "Change"])
+    joined = joined.sort([pl.col("Change").abs()] + keys, descending=[True] + [False] * len(keys))
+    return joined.head(top) if top is not None else joined
@@ -0,0 +1,82 @@
+from __future__ import annotations
+
+from datetime import datetime, timedelta
+
+from services import hierarchy
+from services.lazy import lazy_import
+
+pl = lazy_import("polars")
+
+# (label, upper bound in days); anything older, or without a posting date, is OLDEST_BUCKET
+AGEING_BUCKETS = [
+    ("<6 months", 183),
+    ("6 months - 1 year", 365),
+    ("1 - 2 years", 730),
+    ("2 - 3 years", 1095),
+    ("3 - 5 years", 1825),
+]
+OLDEST_BUCKET = ">5 years"
+
+
+# ========== Helper: Add derived columns ==========
+def derive_columns(df: pl.DataFrame | pl.LazyFrame, current_date: str) -> pl.DataFrame | pl.LazyFrame:
+    """Adds AgeDays, Ageing and the hierarchy levels. Works on eager frames and lazy scans alike."""
+    df = parse_posting_date(df)
+    df = add_ageing(df, current_date)
+    return attach_hierarchy(df)
+
+
+def parse_posting_date(df: pl.DataFrame | pl.LazyFrame) -> pl.DataFrame | pl.LazyFrame:
+    return df.with_columns([
+        pl.col("Posting Date").str.strptime(pl.Date, format="%Y-%m-%d", strict=False),
+    ])
+
+
+def add_ageing(df: pl.DataFrame | pl.LazyFrame, current_date: str) -> pl.DataFrame | pl.LazyFrame:
+    """AgeDays and Ageing relative to `current_date`; Posting Date must already be a date."""
+    current_date_parsed = datetime.strptime(current_date, "%Y-%m-%d")
+    df = df.with_columns([
+        (pl.lit(current_date_parsed) - pl.col("Posting Date")).dt.total_days().alias("AgeDays")
+    ])
+
+    (label, upper), *older = AGEING_BUCKETS
+    ageing = pl.when(pl.col("AgeDays") < upper).then(pl.lit(label))
+    for label, upper in older:
+        ageing = ageing.when(pl.col("AgeDays") < upper).then(pl.lit(label))
+    return df.with_columns([
+        ageing.otherwise(pl.lit(OLDEST_BUCKET)).alias("Ageing")
+    ])
+
+
+def as_of(df: pl.DataFrame | pl.LazyFrame, current_date: str) -> pl.DataFrame | pl.LazyFrame:
+    """Rows already posted on `current_date`; undated rows are kept (they age into OLDEST_BUCKET)."""
+    current_date_parsed = datetime.strptime(current_date, "%Y-%m-%d").date()
+    return df.filter(pl.col("Posting Date").is_null() | (pl.col("Posting Date") <= current_date_parsed))
+
+
+def attach_hierarchy(df: pl.DataFrame | pl.LazyFrame) -> pl.DataFrame | pl.LazyFrame:
+    # Map Division (and Segment/Region) from the hierarchy in the mapping file
+    try:
+        return hierarchy.attach(df)
+    except Exception as e:
+        print(f"[WARN] Failed to load mapping: {e}")
+        return df.with_columns([pl.lit("Others").alias("Division")])
+
+
+def ageing_date_range(ageing: str, current_date: str):
+    """Posting-date bounds (inclusive, None = open) equivalent to one Ageing bucket.
+
+    Returns (first_date, last_date, includes_undated); only OLDEST_BUCKET
+    includes rows without a posting date.
+    """
+    current = datetime.strptime(current_date, "%Y-%m-%d").date()
+    lower = None
+    for label, upper in AGEING_BUCKETS:
+        if label == ageing:
+            first = current - timedelta(days=upper - 1)
+            last = current - timedelta(days=lower) if lower is not None else None
+            return first, last, False
+        lower = upper
+    if ageing == OLDEST_BUCKET:
+        return None, current - timedelta(days=lower), True
+    raise ValueError(f"Unknown ageing bucket: {ageing}")
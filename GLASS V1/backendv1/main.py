@@ -6,7 +6,6 @@ from fastapi.responses import JSONResponse
 import shutil
 import os
 import polars as pl
-import pandas as pd
 from datetime import datetime
 
 app = FastAPI()
@@ -63,6 +62,7 @@ def load_and_prepare_data(file_path: str, mapping_path: str, ref_date: datetime)
         )
 
     # Load mapping and join for Division
+    import pandas as pd  # deferred: pandas is only used for this mapping read
     map_df = pd.read_excel(mapping_path)
     map_pl = pl.from_pandas(map_df)
     df = df.join(map_pl, left_on=BUSINESS_AREA_COL, right_on="Business Area", how="left")
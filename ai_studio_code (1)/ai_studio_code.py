@@ -1,11 +1,20 @@
-import google.generativeai as genai
 import os
 
 # IMPORTANT: Replace "YOUR_API_KEY" with your actual Google AI API key
 # For better security, load it from an environment variable.
 # os.environ['GOOGLE_API_KEY'] = 'YOUR_API_KEY'
 # genai.configure(api_key=os.environ['GOOGLE_API_KEY'])
-genai.configure(api_key="YOUR_API_KEY")
+_genai = None
+
+
+def get_genai():
+    """Import and configure google.generativeai on first use rather than at startup."""
+    global _genai
+    if _genai is None:
+        import google.generativeai as genai
+        genai.configure(api_key="YOUR_API_KEY")
+        _genai = genai
+    return _genai
 
 
 def generate_summary(table1_data: list, table2_data: list, gl_account: str):
@@ -13,7 +22,7 @@ def generate_summary(table1_data: list, table2_data: list, gl_account: str):
     Generates a financial summary using the Gemini Pro model.
     """
     try:
-        model = genai.GenerativeModel('gemini-pro')
+        model = get_genai().GenerativeModel('gemini-pro')
         
         # Create a more structured prompt for better analysis
         prompt = f"""
@@ -2,7 +2,6 @@ from fastapi import FastAPI, UploadFile, File, Query
 from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 import polars as pl
-import pandas as pd
 import os
 import shutil
 from datetime import datetime
@@ -27,6 +26,7 @@ os.makedirs(UPLOAD_DIR, exist_ok=True)
 # Utility: Load mapping Excel
 def load_mapping():
     if os.path.exists(MAPPING_FILE):
+        import pandas as pd  # only needed for read_excel; keep it out of worker boot
         df = pd.read_excel(MAPPING_FILE)
         return dict(zip(df['Business Area'], df['Division']))
     return {}